@@ -36,4 +36,16 @@ assert any(app in INSTALLED_APPS for app in ['posts.apps.PostsConfig', 'posts'])
 pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
+    'tests.fixtures.fixture_budget',
 ]
+
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Кэш страниц сбрасывается после коммита, а тесты откатывают свои
+    # транзакции: страница из другого теста в кэше устарела бы.
+    from django.core.cache import cache
+    cache.clear()
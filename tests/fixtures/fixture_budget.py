@@ -0,0 +1,175 @@
+"""Бюджеты запросов к БД и времени ответа для страниц проекта.
+
+Фикстуры ``budget_client`` и ``user_budget_client`` ведут себя как
+``client`` и ``user_client``, но на каждый запрос считают SQL-запросы,
+время рендеринга шаблонов и время ответа и падают, если страница вышла
+за бюджет своего имени URL из ``BUDGETS``. Бюджет отдельного теста
+меняется маркером::
+
+    @pytest.mark.budget('posts:index', queries=6)
+
+Времена умножаются на переменную окружения ``BUDGET_TIME_FACTOR`` для
+медленных машин. Бюджеты рассчитаны на прогретые миниатюры: первый
+показ картинки создаёт её варианты, поэтому страницы с картинками
+сначала открываются через ``warm_up``.
+"""
+import os
+import re
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.template.base import Template
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+Budget = namedtuple('Budget', 'queries response_ms template_ms')
+Record = namedtuple(
+    'Record', 'view_name path queries response_ms template_ms sql')
+
+# Запросы авторизованного пользователя: сессия и пользователь - 2 из них.
+BUDGETS = {
+    'posts:index': Budget(queries=4, response_ms=500, template_ms=300),
+    'posts:group_list': Budget(queries=5, response_ms=500, template_ms=300),
+    'posts:profile': Budget(queries=4, response_ms=500, template_ms=300),
+    'posts:post_detail': Budget(queries=4, response_ms=500, template_ms=300),
+    'posts:post_create': Budget(queries=3, response_ms=500, template_ms=300),
+    'posts:post_edit': Budget(queries=5, response_ms=500, template_ms=300),
+    'posts:search': Budget(queries=5, response_ms=500, template_ms=300),
+}
+SAVEPOINT_RE = re.compile(r'(RELEASE |ROLLBACK TO )?SAVEPOINT ')
+TIME_FACTOR = float(os.environ.get('BUDGET_TIME_FACTOR', 1))
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'budget(url_name, **limits): бюджет страницы в тесте')
+    config.budget_records = []
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not config.budget_records:
+        return
+    worst = {}
+    for record in config.budget_records:
+        current = worst.get(record.view_name)
+        if current is None or record.response_ms > current.response_ms:
+            worst[record.view_name] = record
+    terminalreporter.section('бюджеты страниц')
+    for view_name, record in sorted(worst.items()):
+        terminalreporter.write_line(
+            f'{view_name:<22} запросов {record.queries:>3}   '
+            f'ответ {record.response_ms:>7.1f} мс   '
+            f'шаблоны {record.template_ms:>7.1f} мс'
+        )
+
+
+@contextmanager
+def template_timer():
+    """Время рендеринга шаблонов; вложенные include не считаются дважды."""
+    spent = [0.0]
+    depth = [0]
+    original = Template._render
+
+    def timed_render(self, context):
+        depth[0] += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            depth[0] -= 1
+            if not depth[0]:
+                spent[0] += (time.perf_counter() - started) * 1000
+
+    Template._render = timed_render
+    try:
+        yield spent
+    finally:
+        Template._render = original
+
+
+class BudgetClient:
+    def __init__(self, client, budgets, records):
+        self.client = client
+        self.budgets = budgets
+        self.records = records
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def warm_up(self, *paths):
+        """Открыть страницы без замера, чтобы создать миниатюры."""
+        for path in paths:
+            self.client.get(path)
+
+    def get(self, path, *args, **kwargs):
+        return self.request('get', path, *args, **kwargs)
+
+    def post(self, path, *args, **kwargs):
+        return self.request('post', path, *args, **kwargs)
+
+    def request(self, method, path, *args, **kwargs):
+        view_name = resolve(path.split('?')[0]).view_name
+        with template_timer() as template_ms, \
+                CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, *args, **kwargs)
+            response_ms = (time.perf_counter() - started) * 1000
+        # SAVEPOINT появляются только из-за транзакции теста.
+        sql = [query['sql'] for query in queries
+               if not SAVEPOINT_RE.match(query['sql'])]
+        record = Record(view_name, path, len(sql), response_ms,
+                        template_ms[0], sql)
+        self.records.append(record)
+        self.check(record)
+        return response
+
+    def check(self, record):
+        budget = self.budgets.get(record.view_name)
+        if budget is None:
+            return
+        problems = []
+        if record.queries > budget.queries:
+            problems.append(
+                f'{record.queries} SQL-запросов при бюджете {budget.queries}:'
+                + ''.join(f'\n    {sql}' for sql in record.sql))
+        if record.response_ms > budget.response_ms * TIME_FACTOR:
+            problems.append(
+                f'ответ {record.response_ms:.0f} мс при бюджете '
+                f'{budget.response_ms * TIME_FACTOR:.0f} мс')
+        if record.template_ms > budget.template_ms * TIME_FACTOR:
+            problems.append(
+                f'шаблоны {record.template_ms:.0f} мс при бюджете '
+                f'{budget.template_ms * TIME_FACTOR:.0f} мс')
+        if problems:
+            pytest.fail(
+                f'Страница `{record.path}` ({record.view_name}) вышла за '
+                'бюджет: ' + '; '.join(problems), pytrace=False)
+
+
+@pytest.fixture
+def budgets(request):
+    """BUDGETS с поправками маркеров budget теста."""
+    result = dict(BUDGETS)
+    for marker in request.node.iter_markers('budget'):
+        view_name, = marker.args
+        base = result.get(view_name, Budget(float('inf'), float('inf'),
+                                            float('inf')))
+        result[view_name] = base._replace(**marker.kwargs)
+    return result
+
+
+@pytest.fixture
+def budget_client(client, budgets, request):
+    # Закэшированная в другом тесте страница исказит замер.
+    cache.clear()
+    return BudgetClient(client, budgets, request.config.budget_records)
+
+
+@pytest.fixture
+def user_budget_client(user_client, budgets, request):
+    cache.clear()
+    return BudgetClient(user_client, budgets, request.config.budget_records)
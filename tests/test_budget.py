@@ -0,0 +1,48 @@
+import pytest
+from django.core.cache import cache
+
+pytestmark = [pytest.mark.django_db]
+
+
+class TestPageBudgets:
+
+    @pytest.mark.parametrize('url', [
+        '/',
+        '/?page=2',
+        '/group/test-link/',
+        '/profile/TestUser/',
+    ])
+    def test_feed_pages_within_budget(self, user_budget_client,
+                                      few_posts_with_group, url):
+        user_budget_client.warm_up(url)
+        response = user_budget_client.get(url)
+        assert response.status_code == 200
+
+    def test_post_pages_within_budget(self, user_budget_client,
+                                      few_posts_with_group):
+        post_id = few_posts_with_group.id
+        user_budget_client.warm_up(f'/posts/{post_id}/')
+        assert user_budget_client.get(f'/posts/{post_id}/').status_code == 200
+        assert user_budget_client.get(
+            f'/posts/{post_id}/edit/').status_code == 200
+        assert user_budget_client.get('/create/').status_code == 200
+
+    def test_search_within_budget(self, user_budget_client,
+                                  few_posts_with_group):
+        response = user_budget_client.get('/search/?q=пост')
+        assert response.status_code == 200
+
+    def test_anonymous_cached_page_is_cheaper(self, budget_client,
+                                              few_posts_with_group):
+        budget_client.warm_up('/')
+        cache.clear()
+        budget_client.get('/')
+        budget_client.get('/')
+        first, second = budget_client.records[-2:]
+        assert second.queries < first.queries
+
+    @pytest.mark.budget('posts:index', queries=0)
+    def test_budget_exceeded_fails(self, budget_client, post):
+        with pytest.raises(pytest.fail.Exception,
+                           match='вышла за бюджет'):
+            budget_client.get('/')
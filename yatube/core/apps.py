@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .db import check_connections, configure_sqlite
+        connection_created.connect(
+            configure_sqlite, dispatch_uid='core.db.configure_sqlite')
+        request_started.connect(
+            check_connections, dispatch_uid='core.db.check_connections')
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def post_card_timeout(request):
+    """Время жизни кэша карточек постов для шаблонов."""
+    return {'post_card_timeout': settings.POST_CARD_CACHE_TIMEOUT}
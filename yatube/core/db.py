@@ -0,0 +1,31 @@
+"""Настройка соединений с БД."""
+from django.db import connections
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Выполнить PRAGMA из DATABASES[alias]['PRAGMAS'] на новом соединении.
+
+    Порядок важен: busy_timeout должен идти первым, чтобы смена
+    journal_mode ждала чужую блокировку, а не падала с ошибкой.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS') or {}
+    for name, value in pragmas.items():
+        # Через сырое соединение: PRAGMA не попадают в счётчики запросов.
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def check_connections(**kwargs):
+    """Закрыть постоянные соединения, которые перестали отвечать.
+
+    Django 2.2 проверяет соединение только после ошибки в нём; с
+    CONN_HEALTH_CHECKS в настройках БД проверка идёт перед каждым
+    запросом, и упавший сервер БД не ломает первый запрос воркера.
+    """
+    for connection in connections.all():
+        if (connection.connection is not None
+                and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not connection.in_atomic_block
+                and not connection.is_usable()):
+            connection.close()
@@ -0,0 +1,283 @@
+"""Метрики в текстовом формате Prometheus.
+
+Каждый процесс считает метрики в памяти и раз в METRICS_FLUSH_INTERVAL
+секунд записывает свои накопленные значения в отдельный файл каталога
+METRICS_DIR. Представление /metrics складывает файлы всех процессов,
+поэтому под многопроцессным WSGI-сервером видны суммарные значения.
+Без METRICS_DIR отдаются метрики только обслужившего запрос процесса.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.core.files.storage import FileSystemStorage
+from django.db.backends.signals import connection_created
+from sorl.thumbnail.base import ThumbnailBackend
+
+from posts.uploads import upload_snapshot
+
+METRICS = {
+    'yatube_http_request_duration_seconds': (
+        'histogram', 'Время ответа по имени URL.'),
+    'yatube_db_queries_total': (
+        'counter', 'SQL-запросы по имени URL.'),
+    'yatube_db_connections_created_total': (
+        'counter', 'Открытые соединения с БД.'),
+    'yatube_cache_hits_total': ('counter', 'Попадания в кэш.'),
+    'yatube_cache_misses_total': ('counter', 'Промахи кэша.'),
+    'yatube_thumbnails_generated_total': (
+        'counter', 'Созданные миниатюры sorl.'),
+    'yatube_media_written_files_total': (
+        'counter', 'Файлы, записанные в MEDIA_ROOT.'),
+    'yatube_media_written_bytes_total': (
+        'counter', 'Байты, записанные в MEDIA_ROOT.'),
+    'yatube_uploads_received_files_total': (
+        'counter', 'Принятые загрузки файлов.'),
+    'yatube_uploads_received_bytes_total': (
+        'counter', 'Байты принятых загрузок.'),
+    'yatube_uploads_received_seconds_total': (
+        'counter', 'Время приёма загрузок.'),
+}
+UPLOAD_METRICS = {
+    'yatube_uploads_received_files_total': 'files',
+    'yatube_uploads_received_bytes_total': 'bytes',
+    'yatube_uploads_received_seconds_total': 'seconds',
+}
+
+_MISSING = object()
+
+
+class Registry:
+    """Метрики процесса: счётчики и гистограммы с метками."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._pid = os.getpid()
+        self._path = None
+        self._flushed = time.monotonic()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def _check_fork(self):
+        # Потомок после fork не должен повторно отдавать счётчики родителя.
+        if os.getpid() != self._pid:
+            self.clear()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            self.counters[key] += amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = settings.METRICS_LATENCY_BUCKETS
+        with self._lock:
+            self._check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """Накопленные значения процесса в виде, пригодном для JSON."""
+        with self._lock:
+            self._check_fork()
+            counters = [[name, labels, value]
+                        for (name, labels), value in self.counters.items()]
+            histograms = [[name, labels, dict(value, buckets=list(
+                value['buckets']))]
+                for (name, labels), value in self.histograms.items()]
+        uploads = upload_snapshot()
+        counters.extend([name, (), uploads[field]]
+                        for name, field in UPLOAD_METRICS.items())
+        return {'counters': counters, 'histograms': histograms}
+
+    def flush(self, directory=None):
+        directory = directory or settings.METRICS_DIR
+        if not directory:
+            return
+        if self._path is None:
+            os.makedirs(directory, exist_ok=True)
+            self._path = os.path.join(
+                directory, f'{self._pid}-{time.time_ns()}.json')
+        temporary = f'{self._path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, self._path)
+        self._flushed = time.monotonic()
+
+    def maybe_flush(self):
+        if (time.monotonic() - self._flushed
+                >= settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+
+registry = Registry()
+
+
+def collect(directory=None):
+    """Сумма снимков всех процессов из METRICS_DIR.
+
+    Файлы завершённых процессов не удаляются: иначе счётчики
+    уменьшались бы при перезапуске воркеров. Каталог очищается при
+    выкладке.
+    """
+    directory = directory or settings.METRICS_DIR
+    if not directory:
+        return [registry.snapshot()]
+    registry.flush(directory)
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            # Файл удалили при очистке каталога.
+            continue
+    return snapshots
+
+
+def _labels(labels, **extra):
+    pairs = [*map(tuple, labels), *extra.items()]
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, value in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(
+                key, {'buckets': [0] * len(value['buckets']),
+                      'sum': 0.0, 'count': 0})
+            for index, count in enumerate(value['buckets']):
+                total['buckets'][index] += count
+            total['sum'] += value['sum']
+            total['count'] += value['count']
+    return counters, histograms
+
+
+def _render_counter(name, counters):
+    return [f'{name}{_labels(labels)} {_number(value)}'
+            for (metric, labels), value in sorted(counters.items())
+            if metric == name]
+
+
+def _render_histogram(name, histograms):
+    buckets = settings.METRICS_LATENCY_BUCKETS
+    lines = []
+    for (metric, labels), value in sorted(histograms.items()):
+        if metric != name:
+            continue
+        for bound, count in zip(buckets, value['buckets']):
+            lines.append(
+                f'{name}_bucket{_labels(labels, le=f"{bound:g}")} {count}')
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} '
+                     f'{value["count"]}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(value["sum"])}')
+        lines.append(f'{name}_count{_labels(labels)} {value["count"]}')
+    return lines
+
+
+def render(snapshots):
+    """Текстовый формат Prometheus для суммы снимков."""
+    counters, histograms = _merge(snapshots)
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            lines.extend(_render_counter(name, counters))
+        else:
+            lines.extend(_render_histogram(name, histograms))
+    return '\n'.join(lines) + '\n'
+
+
+def _metered(method, count):
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        count(self, args, kwargs, result)
+        return result
+    wrapper.metered = True
+    return wrapper
+
+
+def _meter_cache(backend_class):
+    if getattr(backend_class.get, 'metered', False):
+        return
+    get = backend_class.get
+
+    def metered_get(self, key, default=None, version=None):
+        value = get(self, key, _MISSING, version=version)
+        if value is _MISSING:
+            registry.inc('yatube_cache_misses_total')
+            return default
+        registry.inc('yatube_cache_hits_total')
+        return value
+
+    metered_get.metered = True
+    backend_class.get = metered_get
+    if backend_class.get_many is not BaseCache.get_many:
+        # Базовый get_many вызывает get и уже учтён.
+        def count_many(self, args, kwargs, result):
+            keys = list(args[0] if args else kwargs['keys'])
+            registry.inc('yatube_cache_hits_total', len(result))
+            registry.inc('yatube_cache_misses_total',
+                         len(keys) - len(result))
+        backend_class.get_many = _metered(backend_class.get_many, count_many)
+
+
+def _count_media_write(storage, args, kwargs, result):
+    location = os.path.abspath(storage.location)
+    media_root = os.path.abspath(settings.MEDIA_ROOT)
+    if location == media_root or location.startswith(media_root + os.sep):
+        content = args[1] if len(args) > 1 else kwargs['content']
+        registry.inc('yatube_media_written_files_total')
+        registry.inc('yatube_media_written_bytes_total', content.size)
+
+
+def _count_connection(sender, connection, **kwargs):
+    registry.inc('yatube_db_connections_created_total',
+                 alias=connection.alias)
+
+
+def install_hooks():
+    for alias in settings.CACHES:
+        _meter_cache(type(caches[alias]))
+    if not getattr(ThumbnailBackend._create_thumbnail, 'metered', False):
+        ThumbnailBackend._create_thumbnail = _metered(
+            ThumbnailBackend._create_thumbnail,
+            lambda *args: registry.inc('yatube_thumbnails_generated_total'))
+    if not getattr(FileSystemStorage._save, 'metered', False):
+        FileSystemStorage._save = _metered(
+            FileSystemStorage._save, _count_media_write)
+    connection_created.connect(
+        _count_connection, dispatch_uid='core.metrics.connection_created')
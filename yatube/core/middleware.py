@@ -0,0 +1,226 @@
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+from sorl.thumbnail.base import ThumbnailBackend
+
+from . import metrics, routers
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_local = threading.local()
+
+
+class RequestProfile:
+    """Замеры одного запроса: SQL, шаблоны и миниатюры sorl."""
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.thumbnail_ms = 0.0
+        self.template_depth = 0
+        self.thumbnail_depth = 0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_ms += (time.perf_counter() - started) * 1000
+
+
+def _timed(method, attribute):
+    """Обернуть метод так, чтобы время шло в профиль текущего запроса.
+
+    Вне замеряемого запроса обёртка стоит одного обращения к
+    thread-local. Вложенные вызовы (include в шаблоне) не считаются
+    повторно.
+    """
+    depth = f'{attribute[:-3]}_depth'
+
+    def wrapper(self, *args, **kwargs):
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return method(self, *args, **kwargs)
+        setattr(profile, depth, getattr(profile, depth) + 1)
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            setattr(profile, depth, getattr(profile, depth) - 1)
+            if not getattr(profile, depth):
+                setattr(profile, attribute, getattr(profile, attribute)
+                        + (time.perf_counter() - started) * 1000)
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def install_hooks():
+    if not getattr(Template.render, 'profiled', False):
+        Template.render = _timed(Template.render, 'template_ms')
+    if not getattr(ThumbnailBackend.get_thumbnail, 'profiled', False):
+        ThumbnailBackend.get_thumbnail = _timed(
+            ThumbnailBackend.get_thumbnail, 'thumbnail_ms')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ProfileStore:
+    """Последние PROFILING_WINDOW замеров каждого представления.
+
+    Хранится в памяти процесса: у каждого воркера своя статистика.
+    """
+    fields = ('wall_ms', 'sql_count', 'sql_ms', 'template_ms',
+              'thumbnail_ms')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._samples = defaultdict(
+                lambda: deque(maxlen=settings.PROFILING_WINDOW))
+
+    def add(self, view_name, sample):
+        with self._lock:
+            self._samples[view_name].append(sample)
+
+    def summary(self):
+        """Сводка по представлениям, самые медленные по p95 - первыми."""
+        with self._lock:
+            samples = {name: list(rows)
+                       for name, rows in self._samples.items()}
+        rows = []
+        for view_name, view_samples in samples.items():
+            columns = dict(zip(self.fields, zip(*view_samples)))
+            count = len(view_samples)
+            rows.append({
+                'view_name': view_name,
+                'count': count,
+                'wall_p50': percentile(columns['wall_ms'], 0.5),
+                'wall_p95': percentile(columns['wall_ms'], 0.95),
+                **{f'{field}_avg': sum(columns[field]) / count
+                   for field in self.fields[1:]},
+            })
+        return sorted(rows, key=lambda row: row['wall_p95'], reverse=True)
+
+
+profile_store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """Выборочное профилирование запросов.
+
+    Доля PROFILING_SAMPLE_RATE запросов замеряется: время ответа, число
+    и время SQL-запросов, время рендеринга шаблонов и миниатюр sorl.
+    Замеры копятся в profile_store по имени представления, а ответ
+    получает заголовок Server-Timing. Остальные запросы проходят без
+    замеров.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_hooks()
+
+    def __call__(self, request):
+        rate = settings.PROFILING_SAMPLE_RATE
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        _local.profile = profile
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(profile.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else '<unresolved>'
+        profile_store.add(view_name, (
+            wall_ms, profile.sql_count, profile.sql_ms,
+            profile.template_ms, profile.thumbnail_ms))
+        response['Server-Timing'] = ', '.join((
+            f'total;dur={wall_ms:.1f}',
+            f'sql;dur={profile.sql_ms:.1f};desc="{profile.sql_count} queries"',
+            f'tpl;dur={profile.template_ms:.1f}',
+            f'thumb;dur={profile.thumbnail_ms:.1f}',
+        ))
+        return response
+
+
+class MetricsMiddleware:
+    """Время ответа и число SQL-запросов каждого запроса для /metrics."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+        metrics.install_hooks()
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count_query))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else '<unresolved>'
+        metrics.registry.observe(
+            'yatube_http_request_duration_seconds', elapsed, view=view_name)
+        if queries[0]:
+            metrics.registry.inc(
+                'yatube_db_queries_total', queries[0], view=view_name)
+        metrics.registry.maybe_flush()
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """Чтение своих записей при репликах БД.
+
+    Небезопасные запросы (создание и правка поста, комментарий,
+    регистрация) целиком читают из основной БД. Если такой запрос записал
+    модель из DATABASE_PIN_APPS, ответ ставит cookie DATABASE_PIN_COOKIE,
+    и следующие
+    DATABASE_PIN_SECONDS секунд запросы этого клиента тоже читают из
+    основной БД, пока реплики догоняют запись.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        unsafe = request.method not in SAFE_METHODS
+        pinned = unsafe or settings.DATABASE_PIN_COOKIE in request.COOKIES
+        routers.reset_writes(track=unsafe)
+        with ExitStack() as stack:
+            if pinned:
+                stack.enter_context(routers.pin_to_primary())
+            response = self.get_response(request)
+        if routers.has_written():
+            response.set_cookie(
+                settings.DATABASE_PIN_COOKIE, '1',
+                max_age=settings.DATABASE_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,64 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_state = threading.local()
+
+
+@contextmanager
+def pin_to_primary():
+    """Направить чтения текущего потока в основную БД."""
+    previous = getattr(_state, 'pinned', False)
+    _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned = previous
+
+
+def reset_writes(track=False):
+    """Начать запрос: с track записи в модели DATABASE_PIN_APPS
+    отмечаются и закрепляют клиента за основной БД."""
+    _state.wrote = False
+    _state.track = track
+
+
+def has_written():
+    return getattr(_state, 'wrote', False)
+
+
+class PrimaryReplicaRouter:
+    """Записи - в основную БД, чтения - в случайную реплику.
+
+    Реплики перечислены в DATABASE_REPLICAS. Чтения идут в основную БД,
+    если поток закреплён за ней (pin_to_primary) или основная БД
+    внутри транзакции: в ней могут быть ещё не реплицированные записи.
+    """
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (not replicas or getattr(_state, 'pinned', False)
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Служебные записи (KV-хранилище sorl при рендеринге миниатюр,
+        # сессии) не повод читать из основной БД.
+        if (getattr(_state, 'track', False)
+                and model._meta.app_label in settings.DATABASE_PIN_APPS):
+            _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии основной БД, связи между ними допустимы.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схему на реплики переносит репликация.
+        return db not in settings.DATABASE_REPLICAS
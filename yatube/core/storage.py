@@ -0,0 +1,72 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Статика с хэшем в имени и заранее сжатыми копиями .gz и .br.
+
+    Сжатые копии строятся при collectstatic, поэтому при отдаче файла
+    сжимать ничего не нужно. Brotli используется, если установлен пакет
+    brotli.
+    """
+    compress_extensions = ('.css', '.js', '.svg', '.ico', '.json', '.txt',
+                           '.html', '.xml', '.map')
+    compress_min_size = 256
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Без collectstatic (разработка, тесты) манифеста нет:
+            # отдаём исходное имя вместо ошибки рендеринга.
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = dict.fromkeys(paths)
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                names[hashed_name] = None
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name in names:
+            for compressed_name in self.compress(name):
+                yield name, compressed_name, True
+
+    def compress(self, name):
+        """Записать рядом с файлом сжатые копии, если они меньше."""
+        if not name.endswith(self.compress_extensions):
+            return
+        with self.open(name) as original:
+            content = original.read()
+        if len(content) < self.compress_min_size:
+            return
+        variants = [('.gz', gzip.compress(content, compresslevel=9))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for extension, compressed in variants:
+            if len(compressed) >= len(content):
+                continue
+            compressed_name = name + extension
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            self._save(compressed_name, ContentFile(compressed))
+            yield compressed_name
+
+
+def compressed_variants(path):
+    """Сжатые копии файла path: [(кодировка, путь)] в порядке выгодности."""
+    return [
+        (encoding, path + extension)
+        for encoding, extension in (('br', '.br'), ('gzip', '.gz'))
+        if os.path.isfile(path + extension)
+    ]
@@ -1,7 +1,114 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified)
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from . import metrics
+from .middleware import profile_store
+from .storage import compressed_variants
+
+# Имя с хэшем содержимого: bootstrap.min.1a2b3c4d5e6f.css от
+# ManifestStaticFilesStorage, <sha256>.jpg от ContentAddressedStorage или
+# <md5>.jpg миниатюры sorl.
+HASHED_NAME = re.compile(r'(\.[0-9a-f]{12}|(^|/)[0-9a-f]{32,})\.\w+$')
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
 
+
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def profiling_report(request):
+    """Сводка ProfilingMiddleware по представлениям этого процесса."""
+    return render(request, 'core/profiling.html', {
+        'rows': profile_store.summary(),
+        'sample_rate': settings.PROFILING_SAMPLE_RATE,
+        'window': settings.PROFILING_WINDOW,
+    })
+
+
+def metrics_view(request):
+    """Метрики всех процессов для Prometheus."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404('Страница не найдена')
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _negotiate_encoding(request, full_path):
+    """Сжатая копия full_path, которую принимает клиент, или сам файл."""
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = {token.split(';')[0].strip() for token in header.split(',')}
+    for candidate, candidate_path in compressed_variants(full_path):
+        if candidate in accepted:
+            return candidate_path, candidate
+    return full_path, None
+
+
+def _cache_control(path, max_age):
+    # Файл без хэша в имени может смениться под тем же URL.
+    if HASHED_NAME.search(path):
+        return f'public, max-age={max_age}, immutable'
+    return 'public, no-cache'
+
+
+def _not_modified(request, etag, stat):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in if_none_match
+    return not was_modified_since(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'),
+        stat.st_mtime, stat.st_size)
+
+
+def serve_file(request, path, document_root, max_age):
+    """Отдать файл из document_root без участия CDN и nginx.
+
+    Если клиент принимает br или gzip и рядом лежит сжатая копия, отдаётся
+    она. Файл передаётся FileResponse, и WSGI-сервер может отправить его
+    через sendfile. Файлы с хэшем содержимого в имени кэшируются клиентом
+    на max_age секунд, остальные перепроверяются при каждом запросе.
+    """
+    try:
+        full_path = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    if not os.path.isfile(full_path):
+        raise Http404('Файл не найден')
+    content_type, encoding = mimetypes.guess_type(full_path)
+    serve_path, content_encoding = full_path, None
+    if encoding is None:
+        serve_path, content_encoding = _negotiate_encoding(request, full_path)
+    stat = os.stat(serve_path)
+    etag = '"{:x}-{:x}{}"'.format(
+        stat.st_mtime_ns, stat.st_size,
+        f'-{content_encoding}' if content_encoding else '')
+
+    if _not_modified(request, etag, stat):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(
+            open(serve_path, 'rb'),
+            content_type=content_type or 'application/octet-stream')
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+    response['ETag'] = etag
+    response['Cache-Control'] = _cache_control(path, max_age)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
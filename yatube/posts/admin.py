@@ -1,14 +1,29 @@
 from django.contrib import admin
 
-from .models import Post, Group, Comment
+from .models import Post, Group, Comment, AuthorStats
+from .search import get_search_backend
+from .utils import EstimatedCountPaginator
 
 
 class PostAdmin(admin.ModelAdmin):
     list_editable = ('group',)
     list_display = ('pk', 'text', 'pub_date', 'author', 'group')
+    list_select_related = ('author', 'group')
+    # Группа в list_editable тоже выбирается поиском: без этого на каждую
+    # строку списка выводился <select> со всеми группами.
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по индексу вместо LIKE '%...%' по всей таблице.
+        if not search_term:
+            return queryset, False
+        return get_search_backend().filter(queryset, search_term), False
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -20,11 +35,35 @@ class GroupAdmin(admin.ModelAdmin):
 
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('pk', 'post', 'author', 'text', 'created')
+    list_select_related = ('post', 'author')
+    autocomplete_fields = ('post', 'author')
     search_fields = ('text',)
-    list_filter = ('text',)
+    date_hierarchy = 'created'
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Индекс сужает поиск до постов, в комментариях к которым есть
+        # слова запроса; LIKE проверяет только их комментарии.
+        if not search_term:
+            return queryset, False
+        queryset = get_search_backend().filter(
+            queryset, search_term, field='post')
+        return queryset.filter(text__icontains=search_term), False
+
+
+class AuthorStatsAdmin(admin.ModelAdmin):
+    list_display = ('author', 'posts_count', 'comments_count',
+                    'last_post_date')
+    list_select_related = ('author',)
+    search_fields = ('author__username',)
+    readonly_fields = ('posts_count', 'comments_count', 'last_post_date')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
+admin.site.register(AuthorStats, AuthorStatsAdmin)
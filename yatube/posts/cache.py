@@ -0,0 +1,95 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.http import urlencode
+
+
+def _generation_key(scope):
+    return f'page_cache:generation:{scope}'
+
+
+def get_generation(scope):
+    key = _generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        # Начинаем с текущего времени, чтобы после вытеснения счётчика
+        # из кэша не попасть на страницы старого поколения.
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def purge_page_cache(*scopes):
+    """Сделать недоступными закэшированные страницы лент scopes.
+
+    Поколение меняется после коммита: иначе параллельный запрос прочитал
+    бы ещё старые данные и сохранил страницу уже под новым поколением.
+    """
+    def purge():
+        for scope in scopes:
+            try:
+                cache.incr(_generation_key(scope))
+            except ValueError:
+                cache.set(_generation_key(scope), time.time_ns(), None)
+
+    transaction.on_commit(purge)
+
+
+def cache_path(request):
+    """Путь страницы для ключа кэша.
+
+    В ключ идут только PAGE_CACHE_QUERY_PARAMS: произвольная строка
+    запроса не должна заводить в кэше новую запись.
+    """
+    params = [(name, request.GET[name])
+              for name in settings.PAGE_CACHE_QUERY_PARAMS
+              if name in request.GET]
+    if not params:
+        return request.path
+    return f'{request.path}?{urlencode(params)}'
+
+
+def page_cache_key(scope, full_path):
+    path = hashlib.md5(full_path.encode()).hexdigest()
+    return f'page_cache:{scope}:{get_generation(scope)}:{path}'
+
+
+def anonymous_page_cache(scope):
+    """Кэшировать страницу целиком для анонимных GET-запросов.
+
+    scope(**kwargs) по аргументам вью возвращает имя ленты, например
+    'index' или 'group:<slug>'; purge_page_cache сбрасывает все страницы
+    ленты разом. Устаревшая страница ещё PAGE_CACHE_STALE_TIMEOUT секунд
+    отдаётся всем запросам, кроме одного, который её пересобирает.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view_func(request, *args, **kwargs)
+            key = page_cache_key(scope(**kwargs), cache_path(request))
+            entry = cache.get(key)
+            if entry is not None:
+                content, content_type, fresh_until = entry
+                if time.time() < fresh_until or not cache.add(
+                        f'{key}:lock', True, settings.PAGE_CACHE_LOCK_TIMEOUT):
+                    return HttpResponse(content, content_type=content_type)
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                cache.set(
+                    key,
+                    (response.content, response['Content-Type'],
+                     time.time() + settings.PAGE_CACHE_TIMEOUT),
+                    settings.PAGE_CACHE_TIMEOUT
+                    + settings.PAGE_CACHE_STALE_TIMEOUT
+                )
+            cache.delete(f'{key}:lock')
+            return response
+        return wrapper
+    return decorator
@@ -1,12 +1,90 @@
+from io import BytesIO
+
 from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
 
 from .models import Post, Comment
 
 
+class BoundedImageField(forms.ImageField):
+    """ImageField с ограничением размера файла и числа пикселей.
+
+    Размеры картинки читаются из заголовка до полного декодирования,
+    так что «декомпрессионная бомба» отклоняется сразу. Картинка больше
+    POST_IMAGE_MAX_DIMENSION уменьшается до сохранения: имя файла в
+    хранилище - хеш содержимого, и сохранённый файл не меняется.
+    """
+    default_error_messages = {
+        'too_large': 'Файл больше %(limit)s МБ.',
+        'too_many_pixels': 'Картинка больше %(limit)s мегапикселей.',
+    }
+
+    def to_python(self, data):
+        if data in self.empty_values:
+            return None
+        if data.size > settings.POST_IMAGE_MAX_UPLOAD_SIZE:
+            raise ValidationError(
+                self.error_messages['too_large'], code='too_large',
+                params={'limit': settings.POST_IMAGE_MAX_UPLOAD_SIZE // 2**20},
+            )
+        self._check_pixels(data)
+        return self._downscale(super().to_python(data))
+
+    def _check_pixels(self, data):
+        if hasattr(data, 'temporary_file_path'):
+            source = data.temporary_file_path()
+        else:
+            source = data
+        try:
+            with Image.open(source) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            width = height = float('inf')
+        except Exception:
+            # Нечитаемый файл отклонит ImageField.to_python.
+            return
+        finally:
+            if hasattr(data, 'seek'):
+                data.seek(0)
+        if width * height > settings.POST_IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                self.error_messages['too_many_pixels'],
+                code='too_many_pixels',
+                params={'limit': settings.POST_IMAGE_MAX_PIXELS // 10**6},
+            )
+
+    def _downscale(self, data):
+        max_dimension = settings.POST_IMAGE_MAX_DIMENSION
+        if data is None or not max_dimension:
+            return data
+        try:
+            with Image.open(data) as image:
+                if (max(image.size) <= max_dimension
+                        or getattr(image, 'n_frames', 1) > 1):
+                    return data
+                image_format = image.format
+                image.thumbnail((max_dimension, max_dimension),
+                                Image.LANCZOS)
+                content = BytesIO()
+                image.save(content, format=image_format)
+        finally:
+            data.seek(0)
+        downscaled = SimpleUploadedFile(
+            data.name, content.getvalue(), data.content_type)
+        downscaled.image = image
+        return downscaled
+
+
 class PostForm(forms.ModelForm):
     class Meta:
         model = Post
         fields = ('text', 'group', 'image')
+        field_classes = {
+            'image': BoundedImageField,
+        }
         help_texts = {
             'text': 'Текст вашего поста',
             'group': 'Группа где будет отдыхать ваш пост',
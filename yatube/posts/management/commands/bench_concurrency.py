@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from posts.models import Group, Post
+from posts.utils import explicit_dates
+
+from .bench_views import percentile
+
+User = get_user_model()
+# Профиль по умолчанию SQLite против PRAGMAS из настроек БД.
+DEFAULT_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 'full'}
+
+
+class Command(BaseCommand):
+    help = ('Параллельные чтения ленты и публикации постов в файловой '
+            'SQLite: настройки SQLite по умолчанию против PRAGMAS проекта')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument(
+            '--duration', type=float, default=5,
+            help='Длительность прогона каждого профиля, секунд')
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда сравнивает настройки SQLite')
+        settings_dict = connection.settings_dict
+        tuned = settings_dict.get('PRAGMAS') or {}
+        old_test_name = settings_dict['TEST']['NAME']
+        directory = tempfile.mkdtemp()
+        # Файловая тестовая БД: в памяти нет ни журнала, ни блокировок.
+        settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.db')
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        results = {}
+        try:
+            self.seed(options)
+            for profile, pragmas in (('default', DEFAULT_PRAGMAS),
+                                     ('tuned', tuned)):
+                results[profile] = self.run(options, pragmas)
+        finally:
+            settings_dict['PRAGMAS'] = tuned
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            settings_dict['TEST']['NAME'] = old_test_name
+            shutil.rmtree(directory, ignore_errors=True)
+        self.print_report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'options': {key: options[key] for key in (
+                    'readers', 'writers', 'duration', 'posts')},
+                    'results': results}, output, indent=2)
+
+    def seed(self, options):
+        self.author = User.objects.create_user(username='bench')
+        self.group = Group.objects.create(title='Бенчмарк', slug='bench')
+        now = timezone.now()
+        with explicit_dates():
+            Post.objects.bulk_create(
+                (Post(text=f'Пост {i}', author=self.author, group=self.group,
+                      pub_date=now - timedelta(minutes=i))
+                 for i in range(options['posts'])),
+                batch_size=500,
+            )
+
+    def run(self, options, pragmas):
+        connection.close()
+        connection.settings_dict['PRAGMAS'] = pragmas
+        # Новое соединение переключает журнал до старта потоков.
+        connection.ensure_connection()
+        stop = threading.Event()
+        stats = {'read': ([], [0]), 'write': ([], [0])}
+        threads = [
+            threading.Thread(target=self.worker,
+                             args=(self.read, stop, *stats['read']))
+            for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=self.worker,
+                             args=(self.write, stop, *stats['write']))
+            for _ in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        connection.close()
+        result = {}
+        for kind, (timings, errors) in stats.items():
+            result[kind] = {
+                'per_second': round(len(timings) / options['duration'], 1),
+                'p50_ms': round(percentile(timings, 50), 2)
+                if timings else None,
+                'p95_ms': round(percentile(timings, 95), 2)
+                if timings else None,
+                'max_ms': round(max(timings), 2) if timings else None,
+                'errors': errors[0],
+            }
+        return result
+
+    def worker(self, operation, stop, timings, errors):
+        # У каждого потока своё соединение, и на нём выполняются PRAGMA.
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    operation()
+                except OperationalError:
+                    # database is locked: busy_timeout истёк.
+                    errors[0] += 1
+                    continue
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+
+    def read(self):
+        list(Post.objects.select_related('author', 'group')
+             [:settings.NUM_OF_POSTS])
+
+    def write(self):
+        with transaction.atomic():
+            Post.objects.create(text='Новый пост', author=self.author,
+                                group=self.group)
+
+    def print_report(self, results):
+        self.stdout.write(
+            f"{'профиль':<10}{'операция':<10}{'в секунду':>11}"
+            f"{'p50 мс':>9}{'p95 мс':>9}{'max мс':>9}{'ошибок':>8}")
+        for profile, kinds in results.items():
+            for kind, row in kinds.items():
+                self.stdout.write(
+                    f"{profile:<10}{kind:<10}{row['per_second']:>11}"
+                    f"{row['p50_ms']!s:>9}{row['p95_ms']!s:>9}"
+                    f"{row['max_ms']!s:>9}{row['errors']:>8}")
@@ -0,0 +1,211 @@
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (CaptureQueriesContext,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+from faker import Faker
+from PIL import Image
+
+from posts.models import (AuthorStats, Comment, Group, GroupFeedEntry,
+                          Post)
+from posts.search import rebuild_index
+from posts.storage import post_image_storage
+from posts.thumbnails import generate_thumbnails
+from posts.utils import explicit_dates
+
+User = get_user_model()
+VIEWS = ('index', 'group_list', 'profile', 'post_detail', 'post_create')
+
+
+def percentile(values, percent):
+    """Значение, не больше которого percent% выборки (nearest rank)."""
+    ordered = sorted(values)
+    rank = max(1, round(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Command(BaseCommand):
+    help = ('Заполняет тестовую БД синтетическими данными и измеряет '
+            'задержку, число запросов и размер ответа вью постов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--images', type=int, default=20)
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Сколько запросов к каждой вью')
+        parser.add_argument(
+            '--anonymous', action='store_true',
+            help='Читать страницы анонимно, через кэш страниц')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+        parser.add_argument(
+            '--compare', help='JSON прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.faker = Faker('ru_RU')
+        self.faker.seed_instance(options['seed'])
+        media_root = tempfile.mkdtemp()
+        setup_test_environment()
+        # Отдельная тестовая БД: рабочие данные не трогаются.
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(MEDIA_ROOT=media_root,
+                                   THUMBNAIL_ASYNC=False):
+                self.seed(options)
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+        report = {
+            'meta': {
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'date': timezone.now().isoformat(),
+                **{key: options[key] for key in (
+                    'users', 'groups', 'posts', 'comments', 'images',
+                    'requests', 'anonymous', 'seed')},
+            },
+            'results': results,
+        }
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as previous:
+                baseline = json.load(previous)['results']
+        self.print_report(results, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+
+    def seed(self, options):
+        started = time.monotonic()
+        User.objects.bulk_create(
+            User(username=f'user{i}', first_name=self.faker.first_name(),
+                 last_name=self.faker.last_name())
+            for i in range(options['users'])
+        )
+        Group.objects.bulk_create(
+            Group(title=self.faker.catch_phrase(), slug=f'group{i}',
+                  description=self.faker.text(200))
+            for i in range(options['groups'])
+        )
+        self.user_ids = list(User.objects.values_list('id', flat=True))
+        self.group_ids = list(Group.objects.values_list('id', flat=True))
+        images = [self.make_image(i) for i in range(options['images'])]
+        now = timezone.now()
+        with explicit_dates():
+            Post.objects.bulk_create(
+                (Post(text=self.faker.text(400),
+                      author_id=self.random.choice(self.user_ids),
+                      group_id=self.random.choice(self.group_ids + [None]),
+                      image=images[i] if i < len(images) else '',
+                      pub_date=now - timedelta(minutes=i))
+                 for i in range(options['posts'])),
+                batch_size=500,
+            )
+            self.post_ids = list(Post.objects.values_list('id', flat=True))
+            Comment.objects.bulk_create(
+                (Comment(post_id=self.random.choice(self.post_ids),
+                         author_id=self.random.choice(self.user_ids),
+                         text=self.faker.sentence(),
+                         created=now)
+                 for _ in range(options['comments'])),
+                batch_size=500,
+            )
+        for name in images:
+            generate_thumbnails(name)
+        AuthorStats.objects.rebuild()
+        GroupFeedEntry.objects.rebuild()
+        list(rebuild_index())
+        self.stderr.write(
+            f'Данные созданы за {time.monotonic() - started:.1f} с')
+
+    def make_image(self, number):
+        buffer = BytesIO()
+        color = tuple(self.random.randrange(256) for _ in range(3))
+        Image.new('RGB', (1280, 720), color).save(buffer, 'JPEG')
+        return post_image_storage.save(
+            f'posts/bench{number}.jpg',
+            SimpleUploadedFile('bench.jpg', buffer.getvalue()))
+
+    def run(self, options):
+        cache.clear()
+        author = User.objects.get(pk=self.user_ids[0])
+        reader = Client()
+        writer = Client()
+        writer.force_login(author)
+        if not options['anonymous']:
+            reader.force_login(author)
+        usernames = list(User.objects.values_list('username', flat=True))
+        slugs = list(Group.objects.values_list('slug', flat=True))
+        pages = max(1, options['posts'] // settings.NUM_OF_POSTS)
+        requests = {
+            'index': lambda: reader.get(
+                reverse('posts:index'),
+                {'page': self.random.randint(1, pages)}),
+            'group_list': lambda: reader.get(reverse(
+                'posts:group_list', args=[self.random.choice(slugs)])),
+            'profile': lambda: reader.get(reverse(
+                'posts:profile', args=[self.random.choice(usernames)])),
+            'post_detail': lambda: reader.get(reverse(
+                'posts:post_detail',
+                args=[self.random.choice(self.post_ids)])),
+            'post_create': lambda: writer.post(
+                reverse('posts:post_create'),
+                {'text': self.faker.text(200),
+                 'group': self.random.choice(self.group_ids)}),
+        }
+        results = {}
+        for view in VIEWS:
+            timings, queries, sizes = [], [], []
+            for _ in range(options['requests']):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = requests[view]()
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries.append(len(captured))
+                sizes.append(len(response.content))
+            results[view] = {
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p95_ms': round(percentile(timings, 95), 2),
+                'queries': round(statistics.mean(queries), 1),
+                'bytes': round(statistics.mean(sizes)),
+            }
+        return results
+
+    def print_report(self, results, baseline=None):
+        self.stdout.write(
+            f"{'view':<12}{'p50 мс':>10}{'p95 мс':>10}"
+            f"{'запросов':>10}{'байт':>10}")
+        for view, row in results.items():
+            line = (f"{view:<12}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+                    f"{row['queries']:>10}{row['bytes']:>10}")
+            if baseline and view in baseline:
+                before = baseline[view]['p50_ms']
+                change = (row['p50_ms'] - before) / before * 100 if before \
+                    else 0
+                line += f'   p50 {change:+.0f}%'
+            self.stdout.write(line)
@@ -0,0 +1,85 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.models import Comment, Group, Post
+
+User = get_user_model()
+
+
+def user_records(chunk_size):
+    # Пароли и почта не выгружаются: при загрузке авторы получают
+    # непригодный пароль.
+    for username, first_name, last_name in User.objects.order_by(
+            'pk').values_list('username', 'first_name', 'last_name'
+                              ).iterator(chunk_size=chunk_size):
+        yield {'model': 'user', 'username': username,
+               'first_name': first_name, 'last_name': last_name}
+
+
+def group_records(chunk_size):
+    for slug, title, description in Group.objects.order_by(
+            'pk').values_list('slug', 'title', 'description'
+                              ).iterator(chunk_size=chunk_size):
+        yield {'model': 'group', 'slug': slug, 'title': title,
+               'description': description}
+
+
+def post_records(chunk_size):
+    posts = Post.objects.order_by('pk').values_list(
+        'id', 'text', 'pub_date', 'author__username', 'group__slug', 'image')
+    for post_id, text, pub_date, author, group, image in posts.iterator(
+            chunk_size=chunk_size):
+        yield {'model': 'post', 'id': post_id, 'text': text,
+               'pub_date': pub_date.isoformat(), 'author': author,
+               'group': group, 'image': image}
+
+
+def comment_records(chunk_size):
+    comments = Comment.objects.order_by('pk').values_list(
+        'id', 'post_id', 'author__username', 'text', 'created')
+    for comment_id, post_id, author, text, created in comments.iterator(
+            chunk_size=chunk_size):
+        yield {'model': 'comment', 'id': comment_id, 'post': post_id,
+               'author': author, 'text': text,
+               'created': created.isoformat()}
+
+
+class Command(BaseCommand):
+    help = ('Выгружает пользователей, группы, посты и комментарии в NDJSON: '
+            'одна запись JSON на строку')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output', nargs='?', default='-',
+            help='Файл для выгрузки; по умолчанию стандартный вывод')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['batch_size']
+        output = options['output']
+        stream = None
+        if output == '-':
+            write = self.stdout.write
+        else:
+            stream = open(output, 'w', encoding='utf-8')
+
+            def write(line):
+                stream.write(line + '\n')
+        started = time.monotonic()
+        rows = 0
+        try:
+            for records in (user_records, group_records, post_records,
+                            comment_records):
+                for record in records(chunk_size):
+                    write(json.dumps(record, ensure_ascii=False))
+                    rows += 1
+        finally:
+            if stream is not None:
+                stream.close()
+        elapsed = time.monotonic() - started or 1e-9
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено {rows} записей, {rows / elapsed:.0f} в секунду'
+        ))
@@ -0,0 +1,186 @@
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from sorl.thumbnail import default, delete
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts.models import Post
+from posts.storage import post_image_storage
+
+DB_KVSTORE = 'sorl.thumbnail.kvstores.cached_db_kvstore.KVStore'
+
+
+def walk_files(storage, directory):
+    """Файлы каталога хранилища по одному, без списка всего дерева."""
+    stack = [storage.path(directory)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Находит и удаляет картинки постов, на которые не ссылается ни '
+            'один пост, и миниатюры, о которых не знает sorl')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Удалять найденное; без флага только отчёт')
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Не трогать файлы моложе стольких секунд: их пост или '
+                 'запись sorl может быть ещё не сохранена')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = not options['delete']
+        self.verbosity = options['verbosity']
+        self.max_mtime = time.time() - options['min_age']
+        self.collect_originals()
+        if sorl_settings.THUMBNAIL_KVSTORE != DB_KVSTORE:
+            self.stderr.write('KV-хранилище sorl не в БД, миниатюры '
+                              'не проверяются')
+            return
+        self.collect_kvstore()
+        self.collect_thumbnails()
+        if self.dry_run:
+            self.stdout.write('Ничего не удалено: запустите с --delete')
+
+    def collect_originals(self):
+        """Файлы в каталоге картинок постов без ссылающегося поста.
+
+        Здесь и ниже ссылки читаются из основной БД: отставшая реплика
+        не видит новых постов, и их файлы ушли бы в удаление.
+        """
+        upload_to = Post._meta.get_field('image').upload_to
+        scanned = found = size = 0
+        for batch in batched(
+                walk_files(post_image_storage, upload_to), self.batch_size):
+            names = {self._name(post_image_storage, entry): entry
+                     for entry in batch}
+            referenced = set(Post.objects.using(DEFAULT_DB_ALIAS).filter(
+                image__in=names).values_list('image', flat=True))
+            for name, entry in names.items():
+                stat = entry.stat()
+                if name in referenced or stat.st_mtime > self.max_mtime:
+                    continue
+                found += 1
+                size += stat.st_size
+                self._report(name)
+                if not self.dry_run:
+                    # Вместе с файлом уходят его миниатюры и записи sorl.
+                    delete(ImageFile(name, post_image_storage))
+            scanned += len(batch)
+        self._summary('Оригиналы', scanned, found, size)
+
+    def collect_kvstore(self):
+        """Записи sorl об удалённых файлах и о картинках без постов."""
+        upload_to = Post._meta.get_field('image').upload_to
+        prefix = add_prefix('', 'image')
+        last_key = prefix
+        scanned = found = 0
+        while True:
+            rows = list(
+                KVStore.objects.using(DEFAULT_DB_ALIAS)
+                .filter(key__startswith=prefix, key__gt=last_key)
+                .order_by('key').values_list('key', 'value')
+                [:self.batch_size]
+            )
+            if not rows:
+                break
+            last_key = rows[-1][0]
+            images = [deserialize_image_file(value) for _, value in rows]
+            referenced = set(Post.objects.using(DEFAULT_DB_ALIAS).filter(
+                image__in=[image.name for image in images]
+            ).values_list('image', flat=True))
+            for image in images:
+                is_source = image.name.startswith(upload_to)
+                exists = image.exists()
+                if exists and (not is_source or image.name in referenced):
+                    continue
+                if exists and self._is_recent(image):
+                    # Файл могли только что загрузить снова, а его пост
+                    # ещё не записан.
+                    continue
+                found += 1
+                self._report(image.name)
+                if self.dry_run:
+                    continue
+                if is_source:
+                    delete(image)
+                else:
+                    default.kvstore.delete(image, delete_thumbnails=False)
+            scanned += len(rows)
+        self._summary('Записи sorl', scanned, found)
+
+    def collect_thumbnails(self):
+        """Файлы миниатюр, на которые нет записи в KV-хранилище sorl."""
+        storage = default.storage
+        scanned = found = size = 0
+        for batch in batched(
+                walk_files(storage, sorl_settings.THUMBNAIL_PREFIX),
+                self.batch_size):
+            keys = {}
+            for entry in batch:
+                name = self._name(storage, entry)
+                key = add_prefix(ImageFile(name, storage).key)
+                keys[key] = (name, entry)
+            known = set(KVStore.objects.using(DEFAULT_DB_ALIAS).filter(
+                key__in=keys).values_list('key', flat=True))
+            for key, (name, entry) in keys.items():
+                stat = entry.stat()
+                if key in known or stat.st_mtime > self.max_mtime:
+                    continue
+                found += 1
+                size += stat.st_size
+                self._report(name)
+                if not self.dry_run:
+                    storage.delete(name)
+            scanned += len(batch)
+        self._summary('Миниатюры', scanned, found, size)
+
+    def _is_recent(self, image):
+        try:
+            mtime = os.path.getmtime(image.storage.path(image.name))
+        except FileNotFoundError:
+            return False
+        return mtime > self.max_mtime
+
+    def _name(self, storage, entry):
+        return os.path.relpath(entry.path, storage.location).replace(
+            os.sep, '/')
+
+    def _report(self, name):
+        if self.verbosity > 1:
+            self.stdout.write(name)
+
+    def _summary(self, title, scanned, found, size=None):
+        action = 'к удалению' if self.dry_run else 'удалено'
+        line = f'{title}: проверено {scanned}, {action} {found}'
+        if size is not None:
+            line += f' ({size / 2 ** 20:.1f} МБ)'
+        self.stdout.write(line)
@@ -0,0 +1,232 @@
+import json
+import os
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from posts.cache import purge_page_cache
+from posts.models import AuthorStats, Comment, Group, GroupFeedEntry, Post
+from posts.search import get_search_backend
+from posts.storage import post_image_storage
+from posts.utils import explicit_dates
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Загружает NDJSON из export_ndjson пачками через bulk_create. '
+            'id постов и комментариев сохраняются')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input', nargs='?', default='-',
+            help='Файл выгрузки; по умолчанию стандартный ввод')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--media-root',
+            help='MEDIA_ROOT окружения, откуда выгружены посты: картинки '
+                 'будут скопированы в хранилище')
+        parser.add_argument(
+            '--skip-existing', action='store_true',
+            help='Пропускать посты и комментарии с уже занятым id; '
+                 'комментарии к пропущенным постам не загружаются')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.media_root = options['media_root']
+        self.skip_existing = options['skip_existing']
+        self.search = get_search_backend()
+        self.users = {}
+        self.groups = {}
+        self.skipped_posts = set()
+        self.scopes = set()
+        self.counts = {}
+        self.started = time.monotonic()
+        loaders = {
+            'user': self.load_users,
+            'group': self.load_groups,
+            'post': self.load_posts,
+            'comment': self.load_comments,
+        }
+        path = options['input']
+        stream = (sys.stdin if path == '-'
+                  else open(path, encoding='utf-8'))
+        model, batch = None, []
+        try:
+            with explicit_dates():
+                for number, line in enumerate(stream, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        loader = loaders[record.pop('model')]
+                    except (ValueError, KeyError):
+                        raise CommandError(f'Строка {number}: неверная запись')
+                    if batch and (loader != model
+                                  or len(batch) >= self.batch_size):
+                        self.flush(model, batch)
+                        batch = []
+                    model = loader
+                    batch.append(record)
+                if batch:
+                    self.flush(model, batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.finish()
+
+    def flush(self, loader, records):
+        with transaction.atomic():
+            name, count = loader(records)
+        self.counts[name] = self.counts.get(name, 0) + count
+        total = sum(self.counts.values())
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            f'{name}: {self.counts[name]}, всего {total} записей, '
+            f'{total / elapsed:.0f} в секунду'
+        )
+
+    def load_users(self, records):
+        usernames = [record['username'] for record in records]
+        existing = set(User.objects.filter(
+            username__in=usernames).values_list('username', flat=True))
+        # Пароль непригодный: войти можно только после его сброса.
+        User.objects.bulk_create(
+            User(username=record['username'],
+                 first_name=record['first_name'],
+                 last_name=record['last_name'],
+                 password=make_password(None))
+            for record in records if record['username'] not in existing
+        )
+        self.users.update(User.objects.filter(
+            username__in=usernames).values_list('username', 'id'))
+        return 'Пользователи', len(records)
+
+    def load_groups(self, records):
+        slugs = [record['slug'] for record in records]
+        existing = set(Group.objects.filter(
+            slug__in=slugs).values_list('slug', flat=True))
+        Group.objects.bulk_create(
+            Group(slug=record['slug'], title=record['title'],
+                  description=record['description'])
+            for record in records if record['slug'] not in existing
+        )
+        self.groups.update(Group.objects.filter(
+            slug__in=slugs).values_list('slug', 'id'))
+        return 'Группы', len(records)
+
+    def load_posts(self, records):
+        self.resolve_users(records)
+        self.resolve_groups(records)
+        records = self.skip_taken(Post, records)
+        Post.objects.bulk_create(
+            Post(id=record['id'],
+                 text=record['text'],
+                 pub_date=parse_datetime(record['pub_date']),
+                 author_id=self.users[record['author']],
+                 group_id=self.groups.get(record['group']),
+                 image=self.copy_image(record['image']))
+            for record in records
+        )
+        # bulk_create не шлёт сигналов: индекс и кэш лент обновляем сами.
+        self.search.index_posts([record['id'] for record in records])
+        for record in records:
+            self.scopes.add(f"profile:{record['author']}")
+            if record['group']:
+                self.scopes.add(f"group:{record['group']}")
+        return 'Посты', len(records)
+
+    def load_comments(self, records):
+        # Под id пропущенного поста в базе другой пост: комментарии
+        # выгрузки к нему не относятся.
+        orphans = [record for record in records
+                   if record['post'] in self.skipped_posts]
+        if orphans:
+            self.stderr.write(
+                f'Пропущено {len(orphans)} комментариев к пропущенным '
+                'постам')
+            records = [record for record in records
+                       if record['post'] not in self.skipped_posts]
+        self.resolve_users(records)
+        records = self.skip_taken(Comment, records)
+        Comment.objects.bulk_create(
+            Comment(id=record['id'],
+                    post_id=record['post'],
+                    author_id=self.users[record['author']],
+                    text=record['text'],
+                    created=parse_datetime(record['created']))
+            for record in records
+        )
+        self.search.index_posts({record['post'] for record in records})
+        return 'Комментарии', len(records)
+
+    def skip_taken(self, model, records):
+        """Убрать записи с уже занятым id, если задан --skip-existing.
+
+        Без флага такие записи упадут на bulk_create с IntegrityError.
+        """
+        if not self.skip_existing:
+            return records
+        taken = set(model.objects.filter(
+            id__in=[record['id'] for record in records]
+        ).values_list('id', flat=True))
+        if model is Post:
+            self.skipped_posts |= taken
+        return [record for record in records if record['id'] not in taken]
+
+    def resolve_users(self, records):
+        """Дополнить карту авторов из БД, если их не было в выгрузке."""
+        missing = {record['author'] for record in records} - self.users.keys()
+        if not missing:
+            return
+        self.users.update(User.objects.filter(
+            username__in=missing).values_list('username', 'id'))
+        missing -= self.users.keys()
+        if missing:
+            raise CommandError(
+                'Нет пользователей: ' + ', '.join(sorted(missing)))
+
+    def resolve_groups(self, records):
+        """Дополнить карту групп из БД, если их не было в выгрузке."""
+        missing = ({record['group'] for record in records}
+                   - {None, ''} - self.groups.keys())
+        if not missing:
+            return
+        self.groups.update(Group.objects.filter(
+            slug__in=missing).values_list('slug', 'id'))
+        missing -= self.groups.keys()
+        if missing:
+            raise CommandError('Нет групп: ' + ', '.join(sorted(missing)))
+
+    def copy_image(self, name):
+        if not name or not self.media_root:
+            return name
+        path = os.path.join(self.media_root, name)
+        if not os.path.isfile(path):
+            self.stderr.write(f'Нет картинки {path}')
+            return ''
+        with open(path, 'rb') as image:
+            return post_image_storage.save(name, File(image))
+
+    def finish(self):
+        AuthorStats.objects.rebuild()
+        GroupFeedEntry.objects.rebuild()
+        # После вставки с явными id последовательности PostgreSQL
+        # отстают от данных.
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, Group, Post, Comment])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+        purge_page_cache('index', *self.scopes)
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено {sum(self.counts.values())} записей. Миниатюры '
+            'картинок строит warm_thumbnails'
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import AuthorStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов и комментариев авторов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        AuthorStats.objects.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Статистика пересчитана: {AuthorStats.objects.count()} авторов'
+        ))
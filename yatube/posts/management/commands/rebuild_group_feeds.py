@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import GroupFeedEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты групп'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        GroupFeedEntry.objects.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты пересобраны: {GroupFeedEntry.objects.count()} записей'
+        ))
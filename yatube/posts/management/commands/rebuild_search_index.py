@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.search import get_search_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Строит поисковый индекс постов и комментариев заново'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--backend',
+            help='fts5 или index; по умолчанию SEARCH_BACKEND')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['backend'])
+        started = time.monotonic()
+        done = 0
+        for count in rebuild_index(backend, options['batch_size']):
+            done += count
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{done} постов, {done / elapsed:.1f} в секунду')
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс построен: {done} постов'
+        ))
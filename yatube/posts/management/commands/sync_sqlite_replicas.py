@@ -0,0 +1,32 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную SQLite-БД в файлы реплик из DB_REPLICAS. '
+            'Заменяет репликацию при проверке роутера на одной машине')
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Реплики PostgreSQL обновляет репликация')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплики не заданы: укажите DB_REPLICAS')
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                replica = connections[alias]
+                replica.close()
+                target = sqlite3.connect(replica.settings_dict['NAME'])
+                try:
+                    # Онлайн-копия: запись в основную БД не блокируется.
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(
+                    f"{alias}: {replica.settings_dict['NAME']}")
+        finally:
+            source.close()
@@ -0,0 +1,104 @@
+import os
+import time
+from concurrent.futures import Future, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import build_thumbnails, make_executor, refresh_pages
+from posts.workers import run_task
+
+
+class InlineExecutor:
+    """Выполняет задачи в текущем процессе (--workers 0)."""
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Строит миниатюры THUMBNAIL_GEOMETRIES для всех картинок '
+            'постов в пуле процессов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--workers', type=int, default=settings.THUMBNAIL_WORKERS,
+            help='Число процессов; 0 - строить в текущем процессе')
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Не больше стольких картинок в секунду; 0 - без ограничения')
+        parser.add_argument(
+            '--start-after', type=int, default=None,
+            help='Начать с постов, id которых больше указанного')
+        parser.add_argument(
+            '--state-file',
+            help='Файл с id последнего обработанного поста для продолжения')
+
+    def handle(self, *args, **options):
+        state_file = options['state_file']
+        last_id = options['start_after']
+        if last_id is None:
+            last_id = self._read_state(state_file)
+        workers = options['workers']
+        executor = make_executor(workers) if workers else InlineExecutor()
+        rate = options['rate']
+        started = time.monotonic()
+        done = failed = 0
+        try:
+            while True:
+                batch = list(
+                    Post.objects.exclude(image='').filter(pk__gt=last_id)
+                    .order_by('pk').values_list('pk', 'image')
+                    [:options['batch_size']]
+                )
+                if not batch:
+                    break
+                futures = {}
+                for name in dict.fromkeys(image for _, image in batch):
+                    if rate:
+                        delay = (started
+                                 + (done + failed + len(futures)) / rate)
+                        time.sleep(max(0, delay - time.monotonic()))
+                    future = executor.submit(run_task, build_thumbnails, name)
+                    futures[future] = name
+                wait(futures)
+                for future, name in futures.items():
+                    if future.exception() is not None:
+                        failed += 1
+                        self.stderr.write(str(future.exception()))
+                        continue
+                    # Кэш страниц сбрасывает этот процесс, а не процесс пула.
+                    refresh_pages(name)
+                    done += 1
+                last_id = batch[-1][0]
+                self._write_state(state_file, last_id)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Пост {last_id}: {done} картинок, ошибок: {failed}, '
+                    f'{(done + failed) / elapsed:.1f} в секунду'
+                )
+        finally:
+            executor.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {done} картинок, ошибок: {failed}'
+        ))
+
+    def _read_state(self, state_file):
+        if state_file and os.path.exists(state_file):
+            with open(state_file) as state:
+                return int(state.read().strip() or 0)
+        return 0
+
+    def _write_state(self, state_file, last_id):
+        if state_file:
+            with open(state_file, 'w') as state:
+                state.write(str(last_id))
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-18 12:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0008_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Количество постов')),
+                ('comments_count', models.PositiveIntegerField(default=0, verbose_name='Количество комментариев')),
+                ('last_post_date', models.DateTimeField(blank=True, null=True, verbose_name='Дата последнего поста')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_author_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_variants',
+            field=models.TextField(blank=True, editable=False, help_text='JSON-список уменьшенных копий фотографии', verbose_name='Варианты фотографии'),
+        ),
+    ]
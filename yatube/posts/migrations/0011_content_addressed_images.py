@@ -0,0 +1,19 @@
+# Generated by Django 2.2.16 on 2026-10-18 12:21
+
+from django.db import migrations, models
+import posts.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, help_text='Выберите картинку для поста', storage=posts.storage.ContentAddressedStorage(), upload_to='posts/', verbose_name='Фотография публикации'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.16 on 2026-10-18 12:28
+
+from django.db import OperationalError, migrations, models
+import django.db.models.deletion
+
+
+def create_fts_table(apps, schema_editor):
+    # Таблица FTS5 только для SQLite, собранного с FTS5; иначе поиск
+    # работает на SearchTerm/SearchPosting.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE posts_search USING fts5('
+            "text, comments, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        pass
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True, verbose_name='Слово')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.PositiveIntegerField(help_text='Число вхождений, в тексте поста с множителем', verbose_name='Вес')),
+                ('post', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='posts.Post', verbose_name='Пост')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='posts.SearchTerm', verbose_name='Слово')),
+            ],
+            options={
+                'unique_together': {('term', 'post')},
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
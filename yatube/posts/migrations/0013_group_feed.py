@@ -0,0 +1,62 @@
+# Generated by Django 2.2.16 on 2026-10-18 12:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_group_feeds(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    GroupFeedEntry = apps.get_model('posts', 'GroupFeedEntry')
+    alias = schema_editor.connection.alias
+    posts = Post.objects.using(alias).filter(
+        group__isnull=False).select_related('author').order_by('pk')
+    batch = []
+    for post in posts.iterator(chunk_size=500):
+        batch.append(GroupFeedEntry(
+            post_id=post.pk,
+            group_id=post.group_id,
+            pub_date=post.pub_date,
+            text=post.text,
+            image=post.image.name or '',
+            image_variants=post.image_variants,
+            author_id=post.author_id,
+            author_username=post.author.username,
+            author_first_name=post.author.first_name,
+            author_last_name=post.author.last_name,
+        ))
+        if len(batch) >= 500:
+            GroupFeedEntry.objects.using(alias).bulk_create(batch)
+            batch = []
+    GroupFeedEntry.objects.using(alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0012_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupFeedEntry',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed_entry', serialize=False, to='posts.Post', verbose_name='Пост')),
+                ('pub_date', models.DateTimeField(verbose_name='Время публикации')),
+                ('text', models.TextField(verbose_name='Текст поста')),
+                ('image', models.CharField(blank=True, max_length=100, verbose_name='Фотография публикации')),
+                ('image_variants', models.TextField(blank=True, verbose_name='Варианты фотографии')),
+                ('author_username', models.CharField(max_length=150)),
+                ('author_first_name', models.CharField(blank=True, max_length=30)),
+                ('author_last_name', models.CharField(blank=True, max_length=150)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор публикации')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to='posts.Group', verbose_name='Группа')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='groupfeedentry',
+            index=models.Index(fields=['group', '-pub_date', '-post'], name='feed_group_pub_date_idx'),
+        ),
+        migrations.RunPython(fill_group_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def fill_author_stats(apps, schema_editor):
+    # 0009 создала пустую таблицу: счётчики авторов с постами до неё
+    # начинались бы с нуля.
+    app_label, model_name = settings.AUTH_USER_MODEL.split('.')
+    User = apps.get_model(app_label, model_name)
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    alias = schema_editor.connection.alias
+    users = User.objects.using(alias).annotate(
+        num_posts=Count('posts', distinct=True),
+        num_comments=Count('comments', distinct=True),
+        last_post=Max('posts__pub_date'),
+    ).order_by('pk')
+    AuthorStats.objects.using(alias).all().delete()
+    batch = []
+    for user in users.iterator(chunk_size=500):
+        batch.append(AuthorStats(
+            author_id=user.pk,
+            posts_count=user.num_posts,
+            comments_count=user.num_comments,
+            last_post_date=user.last_post,
+        ))
+        if len(batch) >= 500:
+            AuthorStats.objects.using(alias).bulk_create(batch)
+            batch = []
+    AuthorStats.objects.using(alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0013_group_feed'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_author_stats, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,25 @@
-from django.db import models
+import json
+
+from django.db import models, transaction
+from django.db.models import Count, Max
 from django.contrib.auth import get_user_model
 
+from .storage import post_image_storage
+
 User = get_user_model()
 
 
+class PostQuerySet(models.QuerySet):
+    def for_list(self):
+        """Посты для лент: автор и группа одним JOIN'ом, только нужные
+        шаблону колонки."""
+        return self.select_related('author', 'group').only(
+            'id', 'text', 'pub_date', 'image', 'image_variants', 'group',
+            'author__username', 'author__first_name', 'author__last_name',
+            'group__slug',
+        )
+
+
 class Post(models.Model):
     text = models.TextField(
         help_text='Введите текст поста',
@@ -30,17 +46,41 @@ class Post(models.Model):
     image = models.ImageField(
         help_text='Выберите картинку для поста',
         upload_to='posts/',
+        storage=post_image_storage,
         blank=True,
         verbose_name='Фотография публикации'
     )
+    image_variants = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Варианты фотографии',
+        help_text='JSON-список уменьшенных копий фотографии'
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         text_length = 15
         return self.text[:text_length]
 
+    @property
+    def image_variant_list(self):
+        try:
+            return json.loads(self.image_variants)
+        except ValueError:
+            return []
+
 
 class Group(models.Model):
     title = models.CharField(
@@ -82,6 +122,215 @@ class Comment(models.Model):
         verbose_name='Дата создания комментария'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created'],
+                         name='comment_post_created_idx'),
+        ]
+
     def __str__(self) -> str:
         text_length = 50
         return self.text[:text_length]
+
+
+class AuthorStatsManager(models.Manager):
+    def rebuild(self, batch_size=500):
+        """Пересчитать статистику всех авторов с нуля."""
+        users = User.objects.annotate(
+            num_posts=Count('posts', distinct=True),
+            num_comments=Count('comments', distinct=True),
+            last_post=Max('posts__pub_date'),
+        ).order_by('pk')
+        with transaction.atomic():
+            self.all().delete()
+            batch = []
+            for user in users.iterator():
+                batch.append(self.model(
+                    author_id=user.pk,
+                    posts_count=user.num_posts,
+                    comments_count=user.num_comments,
+                    last_post_date=user.last_post,
+                ))
+                if len(batch) >= batch_size:
+                    self.bulk_create(batch)
+                    batch = []
+            self.bulk_create(batch)
+
+
+class AuthorStats(models.Model):
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Автор'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество постов'
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество комментариев'
+    )
+    last_post_date = models.DateTimeField(
+        blank=True, null=True,
+        verbose_name='Дата последнего поста'
+    )
+
+    objects = AuthorStatsManager()
+
+    def __str__(self) -> str:
+        return str(self.author)
+
+
+class GroupFeedManager(models.Manager):
+    def refresh(self, post):
+        """Добавить пост в ленту его группы, перенести или убрать из неё."""
+        if post.group_id is None:
+            self.filter(post_id=post.pk).delete()
+            return
+        self.update_or_create(post_id=post.pk,
+                              defaults=self.model.card_fields(post))
+
+    def rebuild(self, batch_size=500):
+        """Пересобрать ленты всех групп с нуля."""
+        posts = Post.objects.filter(group__isnull=False).select_related(
+            'author').order_by('pk')
+        with transaction.atomic():
+            self.all().delete()
+            batch = []
+            for post in posts.iterator(chunk_size=batch_size):
+                batch.append(self.model(
+                    post_id=post.pk, **self.model.card_fields(post)))
+                if len(batch) >= batch_size:
+                    self.bulk_create(batch)
+                    batch = []
+            self.bulk_create(batch)
+
+
+class GroupFeedEntry(models.Model):
+    """Пост в ленте группы вместе с данными его карточки.
+
+    Страница группы читается одним диапазоном индекса, без JOIN с
+    постами и авторами. Записи поддерживают сигналы posts.signals,
+    целиком ленты пересобирает команда rebuild_group_feeds.
+    """
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='feed_entry',
+        verbose_name='Пост'
+    )
+    # Удаление группы обнуляет group у постов без сигналов post_save,
+    # поэтому её лента удаляется каскадом.
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Группа'
+    )
+    pub_date = models.DateTimeField(verbose_name='Время публикации')
+    text = models.TextField(verbose_name='Текст поста')
+    image = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name='Фотография публикации'
+    )
+    image_variants = models.TextField(
+        blank=True,
+        verbose_name='Варианты фотографии'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор публикации'
+    )
+    author_username = models.CharField(max_length=150)
+    author_first_name = models.CharField(max_length=30, blank=True)
+    author_last_name = models.CharField(max_length=150, blank=True)
+
+    objects = GroupFeedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', '-pub_date', '-post'],
+                         name='feed_group_pub_date_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return str(self.post_id)
+
+    @staticmethod
+    def card_fields(post):
+        return {
+            'group_id': post.group_id,
+            'pub_date': post.pub_date,
+            'text': post.text,
+            'image': post.image.name or '',
+            'image_variants': post.image_variants,
+            'author_id': post.author_id,
+            'author_username': post.author.username,
+            'author_first_name': post.author.first_name,
+            'author_last_name': post.author.last_name,
+        }
+
+    def as_post(self, group):
+        """Пост для карточки, собранный без запросов к БД."""
+        author = User(
+            id=self.author_id,
+            username=self.author_username,
+            first_name=self.author_first_name,
+            last_name=self.author_last_name,
+        )
+        post = Post(
+            id=self.post_id,
+            text=self.text,
+            pub_date=self.pub_date,
+            image=self.image,
+            image_variants=self.image_variants,
+            author=author,
+            group=group,
+        )
+        post._state.adding = False
+        post._state.db = author._state.db = self._state.db
+        return post
+
+
+class SearchTerm(models.Model):
+    term = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name='Слово'
+    )
+
+    def __str__(self) -> str:
+        return self.term
+
+
+class SearchPosting(models.Model):
+    """Вхождение слова в пост для поиска без FTS5."""
+    term = models.ForeignKey(
+        SearchTerm,
+        on_delete=models.CASCADE,
+        related_name='postings',
+        verbose_name='Слово'
+    )
+    # Без CASCADE: при удалении поста Django не выбирает его вхождения
+    # в память, их удаляет один запрос из сигнала.
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='Пост'
+    )
+    weight = models.PositiveIntegerField(
+        verbose_name='Вес',
+        help_text='Число вхождений, в тексте поста с множителем'
+    )
+
+    class Meta:
+        unique_together = ('term', 'post')
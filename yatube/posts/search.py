@@ -0,0 +1,282 @@
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, Sum
+from django.utils.module_loading import import_string
+
+from .models import Comment, Post, SearchPosting, SearchTerm
+
+FTS_TABLE = 'posts_search'
+WORD = re.compile(r'\w+')
+MAX_WORD_LENGTH = 100
+# Вес вхождения в текст поста относительно вхождения в комментарий
+TEXT_WEIGHT = 2
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре, ё приравнена к е."""
+    return [word for word in WORD.findall(text.lower().replace('ё', 'е'))
+            if len(word) <= MAX_WORD_LENGTH]
+
+
+def post_documents(post_ids):
+    """{id поста: (текст, тексты комментариев)} для индексации."""
+    documents = {
+        post_id: [text, []]
+        for post_id, text in Post.objects.filter(
+            pk__in=post_ids).values_list('id', 'text')
+    }
+    comments = Comment.objects.filter(post_id__in=documents).order_by(
+        'post_id', 'created').values_list('post_id', 'text')
+    for post_id, text in comments.iterator():
+        documents[post_id][1].append(text)
+    return {
+        post_id: (text, '\n'.join(comment_texts))
+        for post_id, (text, comment_texts) in documents.items()
+    }
+
+
+class Fts5Backend:
+    """Индекс в виртуальной таблице SQLite FTS5, rowid - id поста.
+
+    Релевантность - bm25 с весом текста поста TEXT_WEIGHT; она делится на
+    1 + возраст/SEARCH_RECENCY_DAYS, так что свежие посты выше старых с
+    тем же совпадением.
+    """
+    def __init__(self, using='default'):
+        self.using = using
+
+    def index_posts(self, post_ids):
+        documents = post_documents(post_ids)
+        with connections[self.using].cursor() as cursor:
+            self._delete(cursor, post_ids)
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, text, comments) '
+                'VALUES (%s, %s, %s)',
+                [(post_id, *document)
+                 for post_id, document in documents.items()]
+            )
+
+    def remove_posts(self, post_ids):
+        with connections[self.using].cursor() as cursor:
+            self._delete(cursor, post_ids)
+
+    def clear(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def filter(self, queryset, query, field='pk'):
+        match = self._match(query)
+        if match is None:
+            return queryset.none()
+        # Не RawSQL в __in: Django возьмёт его в двойные скобки, и SQLite
+        # прочтёт подзапрос как скалярный, то есть только первую строку.
+        opts = queryset.model._meta
+        column = opts.pk.column if field == 'pk' else opts.get_field(
+            field).column
+        qn = connections[self.using].ops.quote_name
+        return queryset.extra(
+            where=[f'{qn(opts.db_table)}.{qn(column)} IN (SELECT rowid '
+                   f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)'],
+            params=[match],
+        )
+
+    def count(self, query):
+        match = self._match(query)
+        if match is None:
+            return 0
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} '
+                'MATCH %s', [match])
+            return cursor.fetchone()[0]
+
+    def ranked_ids(self, query, offset, limit):
+        match = self._match(query)
+        if match is None:
+            return []
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT s.rowid FROM {FTS_TABLE} s '
+                f'JOIN {Post._meta.db_table} p ON p.id = s.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, %s, 1.0) / (1.0 + ('
+                "julianday('now') - julianday(p.pub_date)) / %s), "
+                'p.pub_date DESC LIMIT %s OFFSET %s',
+                [match, float(TEXT_WEIGHT),
+                 float(settings.SEARCH_RECENCY_DAYS), limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _match(self, query):
+        # Каждое слово - отдельная фраза в кавычках: синтаксис FTS5 в
+        # запросе пользователя не интерпретируется.
+        words = tokenize(query)
+        if not words:
+            return None
+        return ' '.join(f'"{word}"' for word in words)
+
+    def _delete(self, cursor, post_ids):
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(post_id,) for post_id in post_ids]
+        )
+
+
+class TokenIndexBackend:
+    """Обратный индекс в таблицах SearchTerm и SearchPosting.
+
+    Работает на любой БД. Найденные посты содержат все слова запроса;
+    сортировка по сумме весов вхождений, при равенстве - свежие выше.
+    """
+    def __init__(self, using='default'):
+        self.using = using
+
+    def index_posts(self, post_ids):
+        documents = post_documents(post_ids)
+        self.remove_posts(post_ids)
+        weights = {}
+        for post_id, (text, comments) in documents.items():
+            counter = Counter(tokenize(comments))
+            for word in tokenize(text):
+                counter[word] += TEXT_WEIGHT
+            weights[post_id] = counter
+        words = set().union(*weights.values())
+        terms = self._terms(words)
+        missing = words - terms.keys()
+        if missing:
+            SearchTerm.objects.using(self.using).bulk_create(
+                [SearchTerm(term=word) for word in missing],
+                ignore_conflicts=True,
+            )
+            terms.update(self._terms(missing))
+        SearchPosting.objects.using(self.using).bulk_create(
+            SearchPosting(term_id=terms[word], post_id=post_id,
+                          weight=weight)
+            for post_id, counter in weights.items()
+            for word, weight in counter.items()
+        )
+
+    def remove_posts(self, post_ids):
+        SearchPosting.objects.using(self.using).filter(
+            post_id__in=post_ids).delete()
+
+    def clear(self):
+        SearchPosting.objects.using(self.using).all().delete()
+        SearchTerm.objects.using(self.using).all().delete()
+
+    def filter(self, queryset, query, field='pk'):
+        return queryset.filter(
+            **{f'{field}__in': self._matches(query).values('post_id')})
+
+    def count(self, query):
+        return self._matches(query).count()
+
+    def ranked_ids(self, query, offset, limit):
+        return list(self._matches(query).order_by(
+            '-score', '-post__pub_date'
+        ).values_list('post_id', flat=True)[offset:offset + limit])
+
+    def _matches(self, query):
+        words = set(tokenize(query))
+        term_ids = list(SearchTerm.objects.using(self.using).filter(
+            term__in=words).values_list('id', flat=True))
+        matches = SearchPosting.objects.using(self.using).filter(
+            term_id__in=term_ids
+        ).values('post_id').annotate(
+            matched=Count('term_id'), score=Sum('weight')
+        ).filter(matched=len(words))
+        if not words or len(term_ids) < len(words):
+            return matches.none()
+        return matches
+
+    def _terms(self, words, chunk_size=500):
+        words = list(words)
+        terms = {}
+        for i in range(0, len(words), chunk_size):
+            terms.update(SearchTerm.objects.using(self.using).filter(
+                term__in=words[i:i + chunk_size]).values_list('term', 'id'))
+        return terms
+
+
+SEARCH_BACKENDS = {
+    'fts5': Fts5Backend,
+    'index': TokenIndexBackend,
+}
+_fts_tables = {}
+
+
+def has_fts_table(using='default'):
+    if using not in _fts_tables:
+        connection = connections[using]
+        _fts_tables[using] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_tables[using]
+
+
+def get_search_backend(name=None, using='default'):
+    """Бэкенд SEARCH_BACKEND; 'auto' - FTS5, если таблица есть."""
+    name = name or settings.SEARCH_BACKEND
+    if name == 'auto':
+        name = 'fts5' if has_fts_table(using) else 'index'
+    backend = SEARCH_BACKENDS.get(name) or import_string(name)
+    return backend(using)
+
+
+class SearchResults:
+    """Выдача поиска для Paginator: COUNT и страница постов по запросу."""
+    def __init__(self, query, backend=None):
+        self.query = query
+        self.backend = backend or get_search_backend()
+
+    def count(self):
+        return self.backend.count(self.query)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        post_ids = self.backend.ranked_ids(
+            self.query, start, index.stop - start)
+        posts = Post.objects.for_list().in_bulk(post_ids)
+        return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+_pending = threading.local()
+
+
+def schedule_reindex(*post_ids):
+    """Переиндексировать посты после коммита.
+
+    Сколько бы раз пост ни менялся в транзакции (пост и все его
+    комментарии при каскадном удалении), индекс обновится один раз.
+    Удалённый пост при переиндексации просто пропадает из индекса.
+    """
+    _pending.__dict__.setdefault('post_ids', set()).update(post_ids)
+    transaction.on_commit(_flush_reindex)
+
+
+def _flush_reindex():
+    post_ids = _pending.__dict__.pop('post_ids', None)
+    if post_ids:
+        get_search_backend().index_posts(post_ids)
+
+
+def rebuild_index(backend=None, batch_size=500):
+    """Построить индекс заново; выдаёт число постов в каждой пачке."""
+    backend = backend or get_search_backend()
+    backend.clear()
+    last_id = 0
+    while True:
+        post_ids = list(Post.objects.filter(pk__gt=last_id).order_by(
+            'pk').values_list('pk', flat=True)[:batch_size])
+        if not post_ids:
+            return
+        backend.index_posts(post_ids)
+        last_id = post_ids[-1]
+        yield len(post_ids)
@@ -0,0 +1,296 @@
+import threading
+
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from .cache import purge_page_cache
+from .models import AuthorStats, Comment, Group, GroupFeedEntry, Post
+from .search import schedule_reindex
+from .thumbnails import release_image
+from .utils import invalidate_post_cards, post_card_key
+
+User = get_user_model()
+
+# Авторы, которых удаляет текущая транзакция, и их посты: см. delete_author.
+_cascade = threading.local()
+
+
+def _current_cascade():
+    """Отметка delete_author, пока её транзакция не завершилась.
+
+    Вместе с отметкой в транзакции ждёт колбэк on_commit. После коммита
+    он её сбрасывает, а при откате (User.delete() упал) Django выбрасывает
+    колбэк, и отметка перестаёт действовать.
+    """
+    state = getattr(_cascade, 'state', None)
+    if state is None:
+        return None
+    pending = transaction.get_connection().run_on_commit
+    if not any(func is state['done'] for _, func in pending):
+        _cascade.state = None
+        return None
+    return state
+
+
+def _deleted_with_author(sender, instance, **kwargs):
+    """Пост или комментарий удаляется каскадом вместе с автором, и его
+    обработали пачкой в delete_author."""
+    if kwargs.get('signal') is not post_delete:
+        return False
+    state = _current_cascade()
+    if state is None:
+        return False
+    if instance.author_id in state['author_ids']:
+        return True
+    return sender is Comment and instance.post_id in state['post_ids']
+
+
+def _seed_author_stats(author_id):
+    """Создать строку статистики автора, если её нет.
+
+    Новая строка сразу получает настоящие счётчики, включая только что
+    сохранённый объект. Возвращает True, если строку создали.
+    """
+    _, created = AuthorStats.objects.get_or_create(
+        author_id=author_id,
+        defaults={
+            'posts_count': lambda: Post.objects.filter(
+                author_id=author_id).count(),
+            'comments_count': lambda: Comment.objects.filter(
+                author_id=author_id).count(),
+            'last_post_date': lambda: Post.objects.filter(
+                author_id=author_id).aggregate(last=Max('pub_date'))['last'],
+        },
+    )
+    return created
+
+
+@receiver(post_save, sender=Post)
+def count_created_post(sender, instance, created, **kwargs):
+    if not created:
+        return
+    with transaction.atomic():
+        if _seed_author_stats(instance.author_id):
+            return
+        AuthorStats.objects.filter(author_id=instance.author_id).update(
+            posts_count=F('posts_count') + 1,
+            last_post_date=instance.pub_date,
+        )
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    if _deleted_with_author(sender, instance, **kwargs):
+        return
+    last_post = Post.objects.filter(
+        author_id=OuterRef('author_id')
+    ).order_by('-pub_date').values('pub_date')[:1]
+    AuthorStats.objects.filter(
+        author_id=instance.author_id, posts_count__gt=0
+    ).update(
+        posts_count=F('posts_count') - 1,
+        last_post_date=Subquery(last_post),
+    )
+
+
+@receiver(post_save, sender=Comment)
+def count_created_comment(sender, instance, created, **kwargs):
+    if not created:
+        return
+    with transaction.atomic():
+        if _seed_author_stats(instance.author_id):
+            return
+        AuthorStats.objects.filter(author_id=instance.author_id).update(
+            comments_count=F('comments_count') + 1,
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    if _deleted_with_author(sender, instance, **kwargs):
+        return
+    AuthorStats.objects.filter(
+        author_id=instance.author_id, comments_count__gt=0
+    ).update(
+        comments_count=F('comments_count') - 1,
+    )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_card(sender, instance, **kwargs):
+    if _deleted_with_author(sender, instance, **kwargs):
+        return
+    key = post_card_key(instance.pk, instance.pub_date)
+    # После коммита: иначе параллельное чтение вернёт в кэш старую
+    # карточку на POST_CARD_CACHE_TIMEOUT.
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_post_cards(sender, instance, **kwargs):
+    invalidate_post_cards(instance.posts.all())
+
+
+@receiver(post_save, sender=User)
+@receiver(pre_delete, sender=User)
+def invalidate_author_post_cards(sender, instance, **kwargs):
+    if kwargs.get('created'):
+        return
+    if kwargs.get('update_fields') == frozenset({'last_login'}):
+        return
+    invalidate_post_cards(instance.posts.all())
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_values(sender, instance, **kwargs):
+    old = Post.objects.filter(pk=instance.pk).values_list(
+        'group_id', 'image').first() if instance.pk else None
+    instance._old_group_id, instance._old_image = old or (None, '')
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def release_post_image(sender, instance, **kwargs):
+    if _deleted_with_author(sender, instance, **kwargs):
+        return
+    if 'created' in kwargs:
+        name = getattr(instance, '_old_image', '')
+        if name == instance.image.name:
+            return
+    else:
+        name = instance.image.name
+    if name:
+        # Файл может понадобиться до конца транзакции: удаление поста
+        # ещё откатится.
+        transaction.on_commit(lambda: release_image(name))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def purge_post_feeds(sender, instance, **kwargs):
+    if _deleted_with_author(sender, instance, **kwargs):
+        return
+    group_ids = {instance.group_id, getattr(instance, '_old_group_id', None)}
+    slugs = Group.objects.filter(pk__in=group_ids - {None}).values_list(
+        'slug', flat=True)
+    purge_page_cache(
+        'index',
+        f'profile:{instance.author.username}',
+        *(f'group:{slug}' for slug in slugs),
+    )
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def purge_group_feeds(sender, instance, **kwargs):
+    purge_page_cache('index', f'group:{instance.slug}')
+
+
+@receiver(post_save, sender=User)
+@receiver(pre_delete, sender=User)
+def purge_author_feeds(sender, instance, **kwargs):
+    if kwargs.get('created'):
+        return
+    if kwargs.get('update_fields') == frozenset({'last_login'}):
+        return
+    slugs = Group.objects.filter(posts__author=instance).values_list(
+        'slug', flat=True).distinct()
+    purge_page_cache(
+        'index',
+        f'profile:{instance.username}',
+        *(f'group:{slug}' for slug in slugs),
+    )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def reindex_post(sender, instance, **kwargs):
+    if _deleted_with_author(sender, instance, **kwargs):
+        return
+    schedule_reindex(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def reindex_commented_post(sender, instance, **kwargs):
+    if _deleted_with_author(sender, instance, **kwargs):
+        return
+    schedule_reindex(instance.post_id)
+
+
+@receiver(pre_delete, sender=User)
+def delete_author(sender, instance, **kwargs):
+    """Подготовить каскадное удаление постов и комментариев автора.
+
+    Обработчики post_delete каждой строки стоили бы нескольких запросов
+    на пост. Вместо них счётчики комментаторов, картинки и поисковый
+    индекс обновляются здесь пачкой, а кэш карточек и страниц сбрасывают
+    invalidate_author_post_cards и purge_author_feeds.
+    """
+    posts = Post.objects.filter(author=instance)
+    post_ids = set(posts.values_list('pk', flat=True))
+    images = set(posts.exclude(image='').values_list('image', flat=True))
+    commented_ids = set(Comment.objects.filter(author=instance).values_list(
+        'post_id', flat=True))
+    # Комментарии других авторов уходят вместе с постами.
+    removed = Comment.objects.filter(
+        post__author=instance, author_id=OuterRef('author_id')
+    ).order_by().values('author_id').annotate(
+        count=Count('pk')).values('count')
+    AuthorStats.objects.exclude(author=instance).filter(
+        author__comments__post__author=instance
+    ).update(comments_count=F('comments_count') - Subquery(removed))
+
+    state = _current_cascade()
+    if state is None:
+        def done():
+            _cascade.state = None
+
+        state = _cascade.state = {
+            'author_ids': set(), 'post_ids': set(), 'done': done}
+        transaction.on_commit(done)
+    state['author_ids'].add(instance.pk)
+    state['post_ids'] |= post_ids
+    schedule_reindex(*post_ids, *commented_ids)
+    if images:
+        transaction.on_commit(lambda: _release_images(images))
+
+
+def _release_images(names):
+    for name in names:
+        release_image(name)
+
+
+@receiver(post_delete, sender=User)
+def author_deleted(sender, instance, **kwargs):
+    # post_delete пользователя приходит после его постов и комментариев.
+    state = _current_cascade()
+    if state is not None:
+        state['author_ids'].discard(instance.pk)
+        if not state['author_ids']:
+            _cascade.state = None
+
+
+@receiver(post_save, sender=Post)
+def update_group_feed(sender, instance, **kwargs):
+    GroupFeedEntry.objects.refresh(instance)
+
+
+@receiver(post_save, sender=User)
+def update_author_feed_entries(sender, instance, created, **kwargs):
+    if created:
+        return
+    if kwargs.get('update_fields') == frozenset({'last_login'}):
+        return
+    GroupFeedEntry.objects.filter(author_id=instance.pk).update(
+        author_username=instance.username,
+        author_first_name=instance.first_name,
+        author_last_name=instance.last_name,
+    )
@@ -0,0 +1,44 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - SHA-256 его содержимого.
+
+    Файл ``posts/photo.jpg`` сохраняется как ``posts/ab/cd/<sha256>.jpg``.
+    Повторная загрузка того же файла не создаёт копию: возвращается имя
+    уже лежащего в хранилище файла, и миниатюры у таких постов общие.
+    """
+    hash_chunk_size = 64 * 2 ** 10
+
+    def _save(self, name, content):
+        target = self.content_name(name, content)
+        if self.exists(target):
+            # Свежий mtime защищает файл от gc_media и release_image,
+            # пока пост, который на него сошлётся, ещё не записан.
+            os.utime(self.path(target))
+            return target
+        saved = super()._save(target, content)
+        if saved != target:
+            # Тот же файл параллельно сохранил другой запрос, а
+            # FileSystemStorage положил рядом копию с суффиксом.
+            self.delete(saved)
+        return target
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks(self.hash_chunk_size):
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        ).replace('\\', '/')
+
+
+post_image_storage = ContentAddressedStorage()
@@ -0,0 +1,87 @@
+from django import template
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from sorl.thumbnail.parsers import parse_geometry
+from sorl.thumbnail.templatetags.thumbnail import ThumbnailNode
+
+from posts.thumbnails import cached_thumbnail, schedule_thumbnails
+
+register = template.Library()
+
+
+class Placeholder:
+    """Заглушка с интерфейсом миниатюры sorl, пока та не построена."""
+    def __init__(self, geometry):
+        self.url = static(settings.THUMBNAIL_PLACEHOLDER)
+        self.width, self.height = parse_geometry(geometry)
+
+
+class AsyncThumbnailNode(ThumbnailNode):
+    """{% thumbnail %}, который не строит миниатюру во время запроса.
+
+    Если миниатюры ещё нет, её построение уходит в пул процессов,
+    а шаблон получает заглушку.
+    """
+    def _render(self, context):
+        file_ = self.file_.resolve(context)
+        if not settings.THUMBNAIL_ASYNC or not file_ or not self.as_var:
+            return super()._render(context)
+        geometry = self.geometry.resolve(context)
+        options = {}
+        for key, expr in self.options:
+            noresolve = {'True': True, 'False': False, 'None': None}
+            value = noresolve.get(str(expr), expr.resolve(context))
+            if key == 'options':
+                options.update(value)
+            else:
+                options[key] = value
+        thumbnail = cached_thumbnail(file_, geometry, **options)
+        if thumbnail is None:
+            schedule_thumbnails(str(file_))
+            thumbnail = Placeholder(geometry)
+        context.push()
+        context[self.as_var] = thumbnail
+        output = self.nodelist_file.render(context)
+        context.pop()
+        return output
+
+
+@register.tag
+def thumbnail(parser, token):
+    return AsyncThumbnailNode(parser, token)
+
+
+@register.inclusion_tag('includes/post_picture.html')
+def post_picture(post):
+    """<picture> с srcset из сохранённых вариантов картинки поста.
+
+    Пока вариантов нет, шаблон выводит обычную миниатюру.
+    """
+    by_format = {}
+    for variant in post.image_variant_list:
+        by_format.setdefault(variant['format'], []).append(variant)
+    fallback = by_format.pop('JPEG', [])
+    display_width = settings.POST_IMAGE_RATIO[0]
+    fallback_src = ''
+    for variant in fallback:
+        if not fallback_src or variant['width'] <= display_width:
+            fallback_src = default_storage.url(variant['name'])
+    return {
+        'post': post,
+        'sources': [
+            {'type': f'image/{image_format.lower()}',
+             'srcset': _srcset(variants)}
+            for image_format, variants in by_format.items()
+        ],
+        'fallback_srcset': _srcset(fallback),
+        'fallback_src': fallback_src,
+        'sizes': settings.POST_IMAGE_SIZES,
+    }
+
+
+def _srcset(variants):
+    return ', '.join(
+        f"{default_storage.url(variant['name'])} {variant['width']}w"
+        for variant in variants
+    )
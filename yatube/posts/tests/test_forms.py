@@ -1,11 +1,21 @@
+from io import BytesIO
+import hashlib
+import shutil
+import tempfile
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from PIL import Image
 
 from posts.models import Post, Group, Comment
 from posts.forms import PostForm
+from posts.uploads import upload_snapshot
 
 User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class PostsFormsTests(TestCase):
@@ -126,3 +136,94 @@ class PostsFormsTests(TestCase):
                 text__exact='Проверочный комментарий',
             ).exists()
         )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadLimitsTests(TestCase):
+    """Проверка ограничений на загружаемые картинки"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.author_client = Client()
+        self.author_client.force_login(ImageUploadLimitsTests.user)
+
+    def make_image(self, size, name='image.png'):
+        content = BytesIO()
+        Image.new('RGB', size).save(content, format='PNG')
+        return SimpleUploadedFile(name=name, content=content.getvalue(),
+                                  content_type='image/png')
+
+    def test_upload_limits(self):
+        """Слишком большая картинка не сохраняется"""
+        with override_settings(POST_IMAGE_MAX_PIXELS=100):
+            response = self.author_client.post(
+                reverse('posts:post_create'),
+                data={'text': 'Большая картинка',
+                      'image': self.make_image((20, 20))},
+            )
+        form = response.context['form']
+        self.assertTrue(form.has_error('image', 'too_many_pixels'))
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POST_IMAGE_MAX_UPLOAD_SIZE=10)
+    def test_oversized_upload_aborted(self):
+        """Приём слишком большого файла прерывается, пост не создаётся"""
+        response = self.author_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Большой файл',
+                  'image': self.make_image((20, 20))},
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Post.objects.exists())
+
+    def test_upload_handler_only_in_post_views(self):
+        """Ограниченный приём файлов не действует на другие формы сайта"""
+        post = Post.objects.create(
+            author=ImageUploadLimitsTests.user, text='Тестовый пост')
+        files = upload_snapshot()['files']
+        response = self.author_client.post(
+            reverse('posts:add_comment', args=[post.id]),
+            data={'text': 'Комментарий с файлом',
+                  'image': self.make_image((20, 20))},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(upload_snapshot()['files'], files)
+        self.author_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост', 'image': self.make_image((20, 20))},
+        )
+        self.assertEqual(upload_snapshot()['files'], files + 1)
+
+    def test_upload_keeps_csrf_check(self):
+        """Представление с загрузкой по-прежнему проверяет CSRF"""
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.force_login(ImageUploadLimitsTests.user)
+        response = csrf_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост без токена',
+                  'image': self.make_image((20, 20))},
+        )
+        self.assertTemplateUsed(response, 'core/403csrf.html')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POST_IMAGE_MAX_DIMENSION=40)
+    def test_downscale_on_upload(self):
+        """Слишком большая картинка уменьшается до сохранения"""
+        self.author_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост', 'image': self.make_image((100, 50))},
+        )
+        post = Post.objects.get()
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (40, 20))
+        with open(post.image.path, 'rb') as stored:
+            digest = hashlib.sha256(stored.read()).hexdigest()
+        self.assertIn(digest, post.image.name)
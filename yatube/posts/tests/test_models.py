@@ -1,8 +1,38 @@
+from datetime import timedelta
+from io import StringIO
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
-from posts.models import Post, Group
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.db import connection, transaction
+from django.db.models.signals import pre_delete
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts.models import Post, Group, Comment, AuthorStats, GroupFeedEntry
+from posts.search import get_search_backend
+from posts.storage import post_image_storage
+from posts.thumbnails import generate_thumbnails
+from sorl.thumbnail.models import KVStore
 
 User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 
 class PostModelTest(TestCase):
@@ -36,3 +66,448 @@ class PostModelTest(TestCase):
         post_result = PostModelTest.group
         self.assertEqual(post_test, post_result, ('Посты сохранились не в '
                                                   'той группе!'))
+
+
+class QueryPlanTest(TestCase):
+    """Проверяем, что выборки лент идут по индексам без сортировки"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Тестовый пост',
+            group=cls.group
+        )
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('TEMP B-TREE', plan)
+        else:
+            self.assertNotIn('Sort', plan)
+
+    def test_listing_queries_use_indexes(self):
+        """Ленты главной, группы, профиля и комментарии идут по индексам"""
+        ordering = ('-pub_date', '-id')
+        test_dict = {
+            'post_pub_date_idx': Post.objects.order_by(*ordering),
+            'post_group_pub_date_idx':
+                self.group.posts.order_by(*ordering),
+            'post_author_pub_date_idx':
+                self.user.posts.order_by(*ordering),
+            'comment_post_created_idx':
+                Comment.objects.filter(post=self.post).order_by('-created'),
+        }
+        for index_name, queryset in test_dict.items():
+            with self.subTest(index_name=index_name):
+                self.assertUsesIndex(queryset[:11], index_name)
+
+
+class SqliteProfileTest(SimpleTestCase):
+    """PRAGMA из настроек БД и проверка постоянных соединений"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wrapper = DatabaseWrapper({
+            **connection.settings_dict,
+            'NAME': os.path.join(self.directory, 'profile.db'),
+        }, alias='profile_test')
+
+    def tearDown(self):
+        self.wrapper.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def pragma(self, name):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_new_connection(self):
+        """Новое соединение получает WAL, synchronous и busy_timeout"""
+        pragmas = settings.DATABASES['default']['PRAGMAS']
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'),
+                         pragmas['busy_timeout'])
+        self.assertEqual(self.pragma('mmap_size'), pragmas['mmap_size'])
+
+    def test_unusable_connection_closed_before_request(self):
+        """Неисправное постоянное соединение закрывается до запроса"""
+        self.wrapper.ensure_connection()
+        with mock.patch('django.db.connections.all',
+                        return_value=[self.wrapper]), \
+                mock.patch.object(self.wrapper, 'is_usable',
+                                  return_value=False):
+            request_started.send(sender=self.__class__)
+        self.assertIsNone(self.wrapper.connection)
+
+
+class GroupFeedTest(TestCase):
+    """Материализованная лента группы следует за постами"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='auth', first_name='Лев', last_name='Толстой')
+        cls.group = Group.objects.create(title='Первая', slug='first')
+        cls.other_group = Group.objects.create(title='Вторая', slug='second')
+
+    def entry(self, post):
+        return GroupFeedEntry.objects.filter(post=post).first()
+
+    def test_entry_follows_post(self):
+        """Запись создаётся, переносится и удаляется вместе с постом"""
+        post = Post.objects.create(
+            author=self.user, text='Пост', group=self.group)
+        entry = self.entry(post)
+        self.assertEqual(entry.group, self.group)
+        self.assertEqual(entry.author_username, 'auth')
+        self.assertEqual(entry.pub_date, post.pub_date)
+
+        post.group = self.other_group
+        post.text = 'Правка'
+        post.save()
+        entry = self.entry(post)
+        self.assertEqual(entry.group, self.other_group)
+        self.assertEqual(entry.text, 'Правка')
+
+        post.group = None
+        post.save()
+        self.assertIsNone(self.entry(post))
+
+        post.group = self.group
+        post.save()
+        post.delete()
+        self.assertFalse(GroupFeedEntry.objects.exists())
+
+    def test_group_delete_drops_feed(self):
+        """Удаление группы удаляет её ленту, посты остаются без группы"""
+        group = Group.objects.create(title='Временная', slug='temp')
+        post = Post.objects.create(author=self.user, text='Пост', group=group)
+        group.delete()
+        post.refresh_from_db()
+        self.assertIsNone(post.group)
+        self.assertIsNone(self.entry(post))
+
+    def test_author_rename_updates_entries(self):
+        """Смена имени автора обновляет карточки в лентах"""
+        author = User.objects.create_user(username='writer')
+        post = Post.objects.create(author=author, text='Пост',
+                                   group=self.group)
+        author.first_name = 'Антон'
+        author.save()
+        card = self.entry(post).as_post(self.group)
+        self.assertEqual(card.author.get_full_name(), 'Антон')
+        self.assertEqual(card, post)
+        self.assertEqual(card.group, self.group)
+
+    def test_image_variants_copied_to_entries(self):
+        """Варианты картинки попадают и в запись ленты"""
+        post = Post.objects.create(
+            author=self.user, text='Пост', group=self.group,
+            image='posts/ab/cd/photo.jpg')
+        with mock.patch('posts.thumbnails.build_image_variants',
+                        return_value=[[320, 'cache/320.jpg']]), \
+                mock.patch('posts.thumbnails.get_thumbnail'), \
+                mock.patch('posts.thumbnails.refresh_pages'):
+            generate_thumbnails(post.image.name)
+        self.assertEqual(self.entry(post).image_variants,
+                         '[[320, "cache/320.jpg"]]')
+
+    def test_rebuild(self):
+        """rebuild_group_feeds восстанавливает ленты после bulk_create"""
+        Post.objects.bulk_create([
+            Post(author=self.user, text=f'Пост {i}', group=self.group)
+            for i in range(3)
+        ] + [Post(author=self.user, text='Без группы')])
+        self.assertFalse(GroupFeedEntry.objects.exists())
+        call_command('rebuild_group_feeds', stdout=StringIO())
+        self.assertEqual(
+            set(GroupFeedEntry.objects.values_list('post_id', flat=True)),
+            set(self.group.posts.values_list('id', flat=True)))
+
+    def test_group_page_reads_feed_only(self):
+        """Страница группы читает ленту без JOIN с постами и авторами"""
+        Post.objects.create(author=self.user, text='Пост', group=self.group)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('posts:group_list', args=[self.group.slug]))
+        feed_query, = [query['sql'] for query in queries
+                       if 'posts_groupfeedentry' in query['sql']
+                       and 'COUNT' not in query['sql']]
+        self.assertNotIn('JOIN', feed_query)
+        self.assertContains(response, 'Лев Толстой')
+
+
+class AuthorStatsModelTest(TestCase):
+    """Проверяем счётчики постов и комментариев автора"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Тестовый пост',
+        )
+
+    def test_stats_follow_posts_and_comments(self):
+        """Счётчики меняются при создании и удалении постов и комментариев"""
+        new_post = Post.objects.create(author=self.user, text='Второй пост')
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий')
+        stats = AuthorStats.objects.get(author=self.user)
+        self.assertEqual(stats.posts_count, 2)
+        self.assertEqual(stats.comments_count, 1)
+        self.assertEqual(stats.last_post_date, new_post.pub_date)
+        new_post.delete()
+        comment.delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.comments_count, 0)
+        self.assertEqual(stats.last_post_date, self.post.pub_date)
+
+    def test_missing_stats_seeded_from_real_counts(self):
+        """Первая запись статистики берёт счётчики из БД, а не с нуля"""
+        author = User.objects.create_user(username='veteran')
+        Post.objects.bulk_create(
+            Post(author=author, text=f'Старый пост {i}') for i in range(2))
+        post = Post.objects.create(author=author, text='Новый пост')
+        Comment.objects.create(post=post, author=author, text='Ответ')
+        stats = AuthorStats.objects.get(author=author)
+        self.assertEqual(stats.posts_count, 3)
+        self.assertEqual(stats.comments_count, 1)
+        self.assertEqual(stats.last_post_date, post.pub_date)
+
+    def test_author_delete_batches_cascade(self):
+        """Удаление автора не запускает обработчики на каждый пост"""
+        reader = User.objects.create_user(username='reader')
+        author = User.objects.create_user(username='author')
+        for i in range(20):
+            post = Post.objects.create(author=author, text=f'Пост {i}')
+            Comment.objects.create(post=post, author=reader, text='Ответ')
+        Comment.objects.create(post=self.post, author=reader, text='Ответ')
+        with CaptureQueriesContext(connection) as queries:
+            author.delete()
+        self.assertLess(len(queries), 30)
+        stats = AuthorStats.objects.get(author=reader)
+        self.assertEqual(stats.comments_count, 1)
+        Comment.objects.filter(author=reader).delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.comments_count, 0)
+
+    def test_failed_author_delete_forgotten(self):
+        """После неудачного удаления автора его посты удаляются обычно"""
+        author = User.objects.create_user(username='author')
+        post = Post.objects.create(author=author, text='Пост')
+
+        def fail(sender, **kwargs):
+            raise RuntimeError
+
+        pre_delete.connect(fail, sender=User)
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                author.delete()
+        finally:
+            pre_delete.disconnect(fail, sender=User)
+        post.delete()
+        self.assertEqual(
+            AuthorStats.objects.get(author=author).posts_count, 0)
+
+    def test_rebuild_author_stats_command(self):
+        """Команда rebuild_author_stats восстанавливает счётчики"""
+        AuthorStats.objects.all().delete()
+        call_command('rebuild_author_stats', stdout=StringIO())
+        stats = AuthorStats.objects.get(author=self.user)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.comments_count, 0)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_ASYNC=False,
+                   POST_IMAGE_RELEASE_MIN_AGE=0)
+@mock.patch('posts.signals.transaction.on_commit', lambda func: func())
+class ContentAddressedImageTest(TestCase):
+    """Картинки постов хранятся по хэшу содержимого и не дублируются"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Файлы не откатываются вместе с транзакцией теста.
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name='small.gif', content=SMALL_GIF):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(name, content, 'image/gif'),
+        )
+
+    def test_same_image_is_stored_once(self):
+        """Одинаковые загрузки получают одно имя файла"""
+        first = self.create_post('small.gif')
+        second = self.create_post('copy.GIF')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^posts/\w\w/\w\w/\w{64}\.gif$')
+        directory = post_image_storage.path(first.image.name).rsplit('/', 1)
+        self.assertEqual(len(post_image_storage.listdir(directory[0])[1]), 1)
+
+    def test_image_removed_with_last_post(self):
+        """Файл удаляется только вместе с последним ссылающимся постом"""
+        first = self.create_post()
+        second = self.create_post()
+        name = first.image.name
+        first.delete()
+        self.assertTrue(post_image_storage.exists(name))
+        second.delete()
+        self.assertFalse(post_image_storage.exists(name))
+
+    def test_recently_saved_image_kept(self):
+        """Повторное сохранение освежает файл, и пост его не удаляет"""
+        first = self.create_post()
+        path = post_image_storage.path(first.image.name)
+        os.utime(path, (0, 0))
+        with override_settings(POST_IMAGE_RELEASE_MIN_AGE=60):
+            second = self.create_post('copy.gif')
+            self.assertGreater(os.path.getmtime(path), 0)
+            first.delete()
+            second.delete()
+        self.assertTrue(post_image_storage.exists(first.image.name))
+
+    def test_replaced_image_is_released(self):
+        """Заменённая картинка удаляется, если больше никому не нужна"""
+        post = self.create_post()
+        old_name = post.image.name
+        post.image = SimpleUploadedFile(
+            'other.gif', SMALL_GIF.replace(b'\x0C', b'\x0D'), 'image/gif')
+        post.save()
+        self.assertNotEqual(post.image.name, old_name)
+        self.assertFalse(post_image_storage.exists(old_name))
+        self.assertTrue(post_image_storage.exists(post.image.name))
+
+    def test_gc_media_command(self):
+        """Команда gc_media находит и удаляет файлы без постов"""
+        post = self.create_post()
+        orphan = post_image_storage.save(
+            'posts/orphan.gif', SimpleUploadedFile('orphan.gif', b'orphan'))
+        thumbnail = default_storage.save(
+            'cache/aa/bb/stale.jpg', SimpleUploadedFile('stale.jpg', b'x'))
+        out = StringIO()
+        call_command('gc_media', min_age=0, stdout=out)
+        self.assertIn('Оригиналы: проверено 2, к удалению 1', out.getvalue())
+        self.assertIn('Миниатюры: проверено 1, к удалению 1', out.getvalue())
+        self.assertTrue(post_image_storage.exists(orphan))
+        call_command('gc_media', delete=True, min_age=0, stdout=StringIO())
+        self.assertFalse(post_image_storage.exists(orphan))
+        self.assertFalse(default_storage.exists(thumbnail))
+        self.assertTrue(post_image_storage.exists(post.image.name))
+
+    def test_gc_media_drops_thumbnails_of_orphans(self):
+        """gc_media удаляет миниатюры и записи sorl картинки без поста"""
+        post = self.create_post()
+        name = post.image.name
+        generate_thumbnails(name)
+        Post.objects.filter(pk=post.pk).update(image='')
+        call_command('gc_media', delete=True, min_age=0, stdout=StringIO())
+        self.assertFalse(post_image_storage.exists(name))
+        self.assertFalse(KVStore.objects.exists())
+        thumbnails = [files for _, _, files in os.walk(
+            default_storage.path('cache/')) if files]
+        self.assertEqual(thumbnails, [])
+
+    def test_gc_media_keeps_fresh_sources(self):
+        """Свежую картинку без поста gc_media не трогает и через sorl"""
+        post = self.create_post()
+        name = post.image.name
+        generate_thumbnails(name)
+        Post.objects.filter(pk=post.pk).update(image='')
+        call_command('gc_media', delete=True, stdout=StringIO())
+        self.assertTrue(post_image_storage.exists(name))
+        self.assertTrue(KVStore.objects.exists())
+
+
+class NdjsonTransferTest(TestCase):
+    """Выгрузка и загрузка постов в NDJSON"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='auth', first_name='Лев', last_name='Толстой')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text='Война и мир')
+        Post.objects.filter(pk=cls.post.pk).update(
+            pub_date=cls.post.pub_date - timedelta(days=400))
+        Comment.objects.create(
+            post=cls.post, author=cls.user, text='Длинновато')
+
+    def test_round_trip(self):
+        """Загрузка выгрузки восстанавливает записи с id и датами"""
+        exported = StringIO()
+        call_command('export_ndjson', stdout=exported, stderr=StringIO())
+        lines = exported.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        post = Post.objects.get(pk=self.post.pk)
+        comment = Comment.objects.get()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as dump:
+            dump.write(exported.getvalue())
+            dump.flush()
+            call_command('import_ndjson', dump.name, batch_size=1,
+                         stdout=StringIO())
+        imported = Post.objects.select_related('author', 'group').get()
+        self.assertEqual(imported.pk, post.pk)
+        self.assertEqual(imported.pub_date, post.pub_date)
+        self.assertEqual(imported.author.get_full_name(), 'Лев Толстой')
+        self.assertFalse(imported.author.has_usable_password())
+        self.assertEqual(imported.group.slug, 'test')
+        self.assertEqual(Comment.objects.get().created, comment.created)
+        self.assertEqual(imported.author.stats.posts_count, 1)
+        self.assertEqual(imported.author.stats.comments_count, 1)
+        self.assertTrue(get_search_backend().filter(
+            Post.objects.all(), 'длинновато').exists())
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+
+    def import_lines(self, lines, **options):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as dump:
+            dump.write('\n'.join(lines))
+            dump.flush()
+            call_command('import_ndjson', dump.name, stdout=StringIO(),
+                         stderr=StringIO(), **options)
+
+    def export_lines(self):
+        exported = StringIO()
+        call_command('export_ndjson', stdout=exported, stderr=StringIO())
+        return exported.getvalue().splitlines()
+
+    def test_skip_existing_drops_comments_of_skipped_posts(self):
+        """Комментарии пропущенного поста не цепляются к чужому посту"""
+        lines = self.export_lines()
+        Comment.objects.all().delete()
+        Post.objects.filter(pk=self.post.pk).update(text='Другой пост')
+        self.import_lines(lines, skip_existing=True)
+        self.assertEqual(Post.objects.get().text, 'Другой пост')
+        self.assertFalse(Comment.objects.exists())
+
+    def test_unknown_group_rejected(self):
+        """Пост с неизвестной группой не загружается без группы"""
+        lines = self.export_lines()
+        Post.objects.all().delete()
+        Group.objects.all().delete()
+        lines = [line for line in lines if '"model": "group"' not in line]
+        with self.assertRaisesMessage(CommandError, 'Нет групп: test'):
+            self.import_lines(lines)
+        self.assertFalse(Post.objects.exists())
@@ -1,12 +1,32 @@
 from http import HTTPStatus
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import mock
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connections
+from django.http import Http404, HttpResponse
 from django.urls import reverse
-from django.test import TestCase, Client
+from django.test import (TestCase, Client, RequestFactory,
+                         SimpleTestCase, override_settings)
 
+from core import metrics
+from core.middleware import ReplicaPinningMiddleware, profile_store
+from core.routers import PrimaryReplicaRouter, pin_to_primary
+from core.views import serve_file
 from posts.models import Post, Group
+from sorl.thumbnail.models import KVStore
 
 User = get_user_model()
+TEMP_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class PostsURLTests(TestCase):
@@ -26,6 +46,7 @@ class PostsURLTests(TestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.user = User.objects.create_user(username='VIP')
         self.authorized_client = Client()
@@ -107,3 +128,243 @@ class PostsURLTests(TestCase):
                              expected_redirect,
                              status_code=HTTPStatus.FOUND,
                              target_status_code=HTTPStatus.OK)
+
+
+class FileServingTests(SimpleTestCase):
+    """Отдача статики и медиа с долгим кэшем и сжатыми копиями"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.css = b'body { color: black; }' * 100
+        os.makedirs(os.path.join(TEMP_ROOT, 'css'), exist_ok=True)
+        with open(os.path.join(TEMP_ROOT, 'css/site.css'), 'wb') as css:
+            css.write(cls.css)
+        with open(os.path.join(TEMP_ROOT, 'css/site.css.gz'), 'wb') as css:
+            css.write(gzip.compress(cls.css))
+        with open(os.path.join(TEMP_ROOT, 'css/site.0123456789ab.css'),
+                  'wb') as css:
+            css.write(cls.css)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_ROOT, ignore_errors=True)
+
+    def serve(self, path, **headers):
+        request = RequestFactory().get('/static/' + path, **headers)
+        return serve_file(request, path, TEMP_ROOT, max_age=3600)
+
+    def test_compressed_copy_served(self):
+        """Клиенту с gzip отдаётся сжатая копия, остальным - исходный файл"""
+        response = self.serve('css/site.css', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(gzip.decompress(b''.join(response)), self.css)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.serve('css/site.css')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response), self.css)
+
+    def test_cache_headers_and_not_modified(self):
+        """Долгий Cache-Control только для имён с хэшем и 304 по ETag"""
+        response = self.serve('css/site.0123456789ab.css')
+        self.assertEqual(response['Cache-Control'],
+                         'public, max-age=3600, immutable')
+        response = self.serve('css/site.0123456789ab.css',
+                              HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        response = self.serve('css/site.css')
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+
+    def test_path_outside_root_not_found(self):
+        """Путь за пределами каталога даёт 404"""
+        with self.assertRaises(Http404):
+            self.serve('../settings.py')
+
+    @override_settings(STATIC_ROOT=os.path.join(TEMP_ROOT, 'collected'))
+    def test_collectstatic_hashes_and_compresses(self):
+        """collectstatic пишет манифест и сжатые копии файлов с хэшем"""
+        call_command('collectstatic', interactive=False, verbosity=0)
+        hashed = staticfiles_storage.stored_name('css/bootstrap.min.css')
+        self.assertRegex(hashed, r'^css/bootstrap\.min\.[0-9a-f]{12}\.css$')
+        self.assertTrue(staticfiles_storage.exists(hashed + '.gz'))
+        self.assertFalse(staticfiles_storage.exists('img/logo.png.gz'))
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class ProfilingMiddlewareTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def setUp(self):
+        cache.clear()
+        profile_store.clear()
+        self.staff_client = Client()
+        self.staff_client.force_login(ProfilingMiddlewareTest.staff)
+
+    def test_sampled_request_is_recorded(self):
+        """Замеренный запрос попадает в отчёт и Server-Timing"""
+        response = self.client.get(reverse('posts:index'))
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^total;dur=[\d.]+, sql;dur=[\d.]+;desc="\d+ queries", '
+            r'tpl;dur=[\d.]+, thumb;dur=[\d.]+$')
+        row, = profile_store.summary()
+        self.assertEqual(row['view_name'], 'posts:index')
+        self.assertEqual(row['count'], 1)
+        self.assertGreater(row['sql_count_avg'], 0)
+        self.assertGreater(row['template_ms_avg'], 0)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_sampling_off(self):
+        """Без выборки запрос не замеряется"""
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(profile_store.summary(), [])
+
+    def test_report_for_staff_only(self):
+        """Отчёт доступен только персоналу"""
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('profiling'))
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        response = self.staff_client.get(reverse('profiling'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'posts:index')
+
+
+@override_settings(METRICS_DIR=os.path.join(TEMP_ROOT, 'metrics'),
+                   MEDIA_ROOT=os.path.join(TEMP_ROOT, 'media'))
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        shutil.rmtree(settings.METRICS_DIR, ignore_errors=True)
+        cache.clear()
+        metrics.registry.clear()
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.content.decode()
+
+    def test_request_latency_and_queries(self):
+        """Время ответа и SQL-запросы учитываются по имени URL"""
+        self.client.get(reverse('posts:index'))
+        body = self.scrape()
+        self.assertIn('# TYPE yatube_http_request_duration_seconds '
+                      'histogram', body)
+        self.assertIn('yatube_http_request_duration_seconds_bucket'
+                      '{view="posts:index",le="+Inf"} 1', body)
+        self.assertIn('yatube_http_request_duration_seconds_count'
+                      '{view="posts:index"} 1', body)
+        self.assertRegex(body, r'yatube_db_queries_total'
+                               r'\{view="posts:index"\} [1-9]')
+
+    def test_cache_and_media_counters(self):
+        """Попадания и промахи кэша и запись в MEDIA_ROOT"""
+        cache.get('metrics-test')
+        cache.set('metrics-test', 1)
+        cache.get('metrics-test')
+        default_storage.save('metrics/file.txt', ContentFile(b'12345'))
+        body = self.scrape()
+        self.assertIn('yatube_cache_hits_total 1', body)
+        self.assertIn('yatube_cache_misses_total 1', body)
+        self.assertIn('yatube_media_written_files_total 1', body)
+        self.assertIn('yatube_media_written_bytes_total 5', body)
+
+    def test_processes_are_summed(self):
+        """Снимки других процессов из METRICS_DIR складываются"""
+        metrics.registry.inc('yatube_thumbnails_generated_total', 2)
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        with open(os.path.join(settings.METRICS_DIR, '1-1.json'), 'w') as f:
+            f.write('{"counters": [["yatube_thumbnails_generated_total", '
+                    '[], 3]], "histograms": []}')
+        self.assertIn('yatube_thumbnails_generated_total 5', self.scrape())
+
+    def test_foreign_address_not_allowed(self):
+        """Метрики недоступны с адресов не из METRICS_ALLOWED_IPS"""
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTest(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request, write=None):
+        """Куда роутер направил чтение внутри запроса"""
+        seen = {}
+
+        def view(request):
+            seen['read'] = self.router.db_for_read(Post)
+            if write:
+                self.router.db_for_write(write)
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return seen['read'], response
+
+    def test_reads_go_to_replica_writes_to_primary(self):
+        """Чтения идут в реплику, записи - в основную БД"""
+        self.assertEqual(self.router.db_for_read(Post), 'replica1')
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+        with pin_to_primary():
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+        with mock.patch.object(connections['default'], 'in_atomic_block',
+                               True):
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_unsafe_request_reads_primary_and_pins_client(self):
+        """POST читает из основной БД и закрепляет клиента за ней"""
+        database, response = self.route(
+            self.factory.post(reverse('posts:post_create')), write=Post)
+        self.assertEqual(database, 'default')
+        cookie = response.cookies[settings.DATABASE_PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.DATABASE_PIN_SECONDS)
+
+        request = self.factory.get(reverse('posts:index'))
+        request.COOKIES[settings.DATABASE_PIN_COOKIE] = '1'
+        database, response = self.route(request)
+        self.assertEqual(database, 'default')
+        self.assertNotIn(settings.DATABASE_PIN_COOKIE, response.cookies)
+
+    def test_safe_request_reads_replica(self):
+        """GET без cookie читает из реплики и не закрепляет клиента"""
+        database, response = self.route(
+            self.factory.get(reverse('posts:index')))
+        self.assertEqual(database, 'replica1')
+        self.assertNotIn(settings.DATABASE_PIN_COOKIE, response.cookies)
+
+    def test_service_writes_do_not_pin(self):
+        """Запись sorl при GET и служебные записи POST не закрепляют"""
+        database, response = self.route(
+            self.factory.get(reverse('posts:index')), write=KVStore)
+        self.assertEqual(database, 'replica1')
+        self.assertNotIn(settings.DATABASE_PIN_COOKIE, response.cookies)
+        database, response = self.route(
+            self.factory.post(reverse('posts:post_create')), write=KVStore)
+        self.assertNotIn(settings.DATABASE_PIN_COOKIE, response.cookies)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        """Без реплик всё идёт в основную БД, cookie не ставится"""
+        database, response = self.route(
+            self.factory.post(reverse('posts:post_create')), write=Post)
+        self.assertEqual(database, 'default')
+        self.assertFalse(response.cookies)
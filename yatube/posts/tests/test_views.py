@@ -1,15 +1,36 @@
+from datetime import timedelta
+from io import BytesIO, StringIO
 from itertools import islice
+from unittest import mock
+import json
+import os
+import sqlite3
+import subprocess
+import sys
 import tempfile
 import shutil
 
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase, Client, override_settings
+from django.test import (
+    TestCase, TransactionTestCase, Client, override_settings)
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django import forms
+from PIL import Image
 
-from posts.models import Post, Group
+from posts.cache import page_cache_key
+from posts.models import Comment, Group, GroupFeedEntry, Post
+from posts.search import get_search_backend, rebuild_index
+from posts.thumbnails import (
+    build_thumbnails, cached_thumbnail, generate_thumbnails, make_executor)
+from posts.utils import KeysetPaginator, cached_count, post_card_key
+from posts.workers import run_task
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -85,8 +106,11 @@ class PaginatorViewsTest(TestCase):
         ) for i in range(batch_size))
         batch = list(islice(objs, batch_size))
         Post.objects.bulk_create(batch)
+        # bulk_create идёт мимо сигналов, ленты групп пересобираются.
+        GroupFeedEntry.objects.rebuild()
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.group_arg = PaginatorViewsTest.group.slug
         self.user_arg = PaginatorViewsTest.user.username
@@ -135,6 +159,50 @@ class PaginatorViewsTest(TestCase):
         self.assertEqual(len(response.context['page_obj']),
                          self.num_of_posts_3)
 
+    def test_paginator_next_cursor_index(self):
+        """Курсор следующей страницы ведёт на вторую страницу"""
+        response = self.guest_client.get(reverse('posts:index'))
+        first_page = response.context['page_obj']
+        response = self.guest_client.get(
+            reverse('posts:index'), {'cursor': first_page.next_cursor})
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), self.num_of_posts_3)
+        self.assertEqual(page_obj.number, 2)
+        self.assertFalse(page_obj.has_next())
+        self.assertTrue(set(first_page).isdisjoint(page_obj))
+
+    def test_paginator_previous_cursor_index(self):
+        """Курсор предыдущей страницы возвращает первую страницу"""
+        first_page = self.guest_client.get(
+            reverse('posts:index')).context['page_obj']
+        second_page = self.guest_client.get(
+            reverse('posts:index') + '?page=2').context['page_obj']
+        response = self.guest_client.get(
+            reverse('posts:index'), {'cursor': second_page.previous_cursor})
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.number, 1)
+        self.assertEqual(list(page_obj), list(first_page))
+
+    def test_paginator_cursors_group(self):
+        """Курсоры ленты группы листают её в обе стороны"""
+        url = reverse('posts:group_list', args=[self.group.slug])
+        first_page = self.guest_client.get(url).context['page_obj']
+        second_page = self.guest_client.get(
+            url, {'cursor': first_page.next_cursor}).context['page_obj']
+        self.assertEqual(len(second_page), self.num_of_posts_3)
+        self.assertTrue(set(first_page).isdisjoint(second_page))
+        page_obj = self.guest_client.get(
+            url, {'cursor': second_page.previous_cursor}).context['page_obj']
+        self.assertEqual(list(page_obj), list(first_page))
+
+    def test_paginator_bad_cursor_index(self):
+        """Подделанный курсор ведёт на первую страницу"""
+        response = self.guest_client.get(reverse('posts:index'),
+                                         {'cursor': 'broken'})
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.number, 1)
+        self.assertEqual(len(page_obj), self.num_of_posts_10)
+
 
 class ContextViewTest(TestCase):
     """Проверка правильности контекста и дополнительная проверка
@@ -164,6 +232,8 @@ class ContextViewTest(TestCase):
         ) for i in range(batch_size))
         batch = list(islice(objs, batch_size))
         Post.objects.bulk_create(batch)
+        # bulk_create идёт мимо сигналов, ленты групп пересобираются.
+        GroupFeedEntry.objects.rebuild()
 # Создание постов с другим автором и без группы
         batch_size = 3
         objs = (Post(
@@ -299,28 +369,28 @@ class PhotoContextTest(TestCase):
         """"Проверка наличия фото на главной странице"""
         response = self.author_client.get(reverse('posts:index'))
         post_image = response.context.get('page_obj')[0].image
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, PhotoContextTest.post.image.name)
 
     def test_image_context_group_view(self):
         """"Проверка наличия фото на странице группы"""
         response = self.author_client.get(reverse('posts:group_list',
                                                   args=[self.group_arg]))
         post_image = response.context.get('page_obj')[0].image
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, PhotoContextTest.post.image.name)
 
     def test_image_context_profile_view(self):
         """"Проверка наличия фото на странице профиля"""
         response = self.author_client.get(reverse('posts:profile',
                                                   args=[self.user_arg]))
         post_image = response.context.get('page_obj')[0].image
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, PhotoContextTest.post.image.name)
 
     def test_image_context_post_detail_view(self):
         """"Проверка наличия фото на странице детализации поста"""
         response = self.author_client.get(reverse('posts:post_detail',
                                                   args=[self.post_arg]))
         post_image = response.context.get('post').image
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, PhotoContextTest.post.image.name)
 
     def test_post_with_image_creation_db(self):
         """Проверка сохранения нового поста в БД"""
@@ -354,3 +424,642 @@ class PhotoContextTest(TestCase):
                 text__exact='Текст2',
             ).exists()
         )
+
+
+class QueryCountViewTest(TestCase):
+    """Число запросов к БД на страницах не зависит от числа постов"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Тестовый пост',
+            group=cls.group
+        )
+        batch_size = 15
+        objs = (Post(
+            author=cls.user,
+            text=f'Тест {i}',
+            group=cls.group
+        ) for i in range(batch_size))
+        batch = list(islice(objs, batch_size))
+        Post.objects.bulk_create(batch)
+        # bulk_create идёт мимо сигналов, ленты групп пересобираются.
+        GroupFeedEntry.objects.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_listing_views_num_queries(self):
+        """Ленты укладываются в фиксированный бюджет запросов"""
+        test_dict = {
+            reverse('posts:index'): 2,
+            reverse('posts:group_list', args=[self.group.slug]): 3,
+            reverse('posts:profile', args=[self.user.username]): 2,
+            reverse('posts:post_detail', args=[self.post.id]): 2,
+        }
+        for url, num_queries in test_dict.items():
+            with self.subTest(url=url):
+                with self.assertNumQueries(num_queries):
+                    self.guest_client.get(url)
+
+
+class CountStrategyTest(TestCase):
+    """Проверка способов подсчёта постов для пагинатора"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        batch_size = 13
+        objs = (Post(
+            author=cls.user,
+            text=f'Тест {i}',
+        ) for i in range(batch_size))
+        batch = list(islice(objs, batch_size))
+        Post.objects.bulk_create(batch)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_cached_count(self):
+        """Кэшированный счётчик не считает посты повторно"""
+        cached_count(Post.objects.all())
+        with self.assertNumQueries(0):
+            count, is_exact = cached_count(Post.objects.all())
+        self.assertEqual(count, 13)
+        self.assertFalse(is_exact)
+
+    @override_settings(PAGINATOR_COUNT_STRATEGY='estimated')
+    def test_estimated_count_index(self):
+        """Оценка числа постов не превышает наибольший id"""
+        response = self.guest_client.get(reverse('posts:index'))
+        paginator = response.context['page_obj'].paginator
+        self.assertGreaterEqual(paginator.count, 13)
+        self.assertFalse(paginator.count_is_exact)
+        self.assertNotContains(response, 'Последняя')
+
+    @override_settings(PAGINATOR_COUNT_STRATEGY='estimated')
+    def test_estimated_count_overflow_index(self):
+        """Завышенная оценка не ломает переход на последнюю страницу"""
+        Post.objects.filter(
+            pk__in=Post.objects.values('pk')[:5]).delete()
+        response = self.guest_client.get(reverse('posts:index') + '?page=2')
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.number, 1)
+        self.assertEqual(len(page_obj), 8)
+
+
+class ElidedPageRangeTest(TestCase):
+    """Проверка сокращённого списка номеров страниц"""
+    def setUp(self):
+        self.paginator = KeysetPaginator(Post.objects.all(), 10)
+        self.paginator.count = 500
+
+    def test_elided_page_range_middle(self):
+        """В середине выводятся края и соседи текущей страницы"""
+        ellipsis = KeysetPaginator.ELLIPSIS
+        self.assertEqual(
+            list(self.paginator.get_elided_page_range(25)),
+            [1, ellipsis, 23, 24, 25, 26, 27, ellipsis, 50]
+        )
+
+    def test_elided_page_range_approximate_count(self):
+        """При приблизительном счётчике последняя страница не выводится"""
+        self.paginator.count_is_exact = False
+        ellipsis = KeysetPaginator.ELLIPSIS
+        self.assertEqual(
+            list(self.paginator.get_elided_page_range(1)),
+            [1, 2, 3, ellipsis]
+        )
+
+
+@mock.patch('posts.signals.transaction.on_commit', lambda func: func())
+class PostCardCacheTest(TestCase):
+    """Проверка кэша карточек постов"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Старый текст',
+            group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_post_card_cached_until_post_saved(self):
+        """Карточка берётся из кэша, пока пост не сохранён заново"""
+        self.guest_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=self.post.pk).update(text='Новый текст')
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Старый текст')
+        post = Post.objects.get(pk=self.post.pk)
+        post.save()
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Новый текст')
+
+    def test_post_card_dropped_after_commit(self):
+        """Карточка сбрасывается после коммита, а не внутри транзакции"""
+        self.guest_client.get(reverse('posts:index'))
+        key = post_card_key(self.post.id, self.post.pub_date)
+        with mock.patch('posts.signals.transaction.on_commit') as on_commit:
+            Post.objects.get(pk=self.post.pk).save()
+            self.assertIsNotNone(cache.get(key))
+            for call in on_commit.call_args_list:
+                call[0][0]()
+        self.assertIsNone(cache.get(key))
+
+    def test_post_card_invalidated_by_group_and_author(self):
+        """Изменение группы или автора сбрасывает карточки их постов"""
+        self.guest_client.get(reverse('posts:index'))
+        self.group.slug = 'new-slug'
+        self.group.save()
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, '/group/new-slug/')
+        self.user.first_name = 'Лев'
+        self.user.last_name = 'Толстой'
+        self.user.save()
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Лев Толстой')
+
+
+@mock.patch('posts.cache.transaction.on_commit', lambda func: func())
+class PageCacheTest(TestCase):
+    """Проверка кэша страниц лент для анонимов"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other',
+            description='Другое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Тестовый пост',
+            group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.author_client = Client()
+        self.author_client.force_login(PageCacheTest.user)
+
+    def test_index_cached_for_guest(self):
+        """Главная отдаётся гостю из кэша без запросов к БД"""
+        self.guest_client.get(reverse('posts:index'))
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Тестовый пост')
+
+    def test_unknown_query_params_share_entry(self):
+        """Лишние параметры запроса не заводят новых записей в кэше"""
+        self.guest_client.get(reverse('posts:index'), {'page': 1})
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(
+                reverse('posts:index'), {'utm_source': 'mail', 'page': 1})
+        self.assertContains(response, 'Тестовый пост')
+
+    def test_purge_waits_for_commit(self):
+        """Поколение ленты меняется только после коммита"""
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        with mock.patch('posts.cache.transaction.on_commit') as on_commit:
+            Post.objects.create(author=self.user, text='Новый пост')
+            response = self.guest_client.get(url)
+            self.assertNotContains(response, 'Новый пост')
+            for call in on_commit.call_args_list:
+                call[0][0]()
+        response = self.guest_client.get(url)
+        self.assertContains(response, 'Новый пост')
+
+    def test_new_post_purges_feeds(self):
+        """Новый пост сбрасывает главную, ленту группы и профиль"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.user.username]),
+        )
+        for url in urls:
+            self.guest_client.get(url)
+        self.author_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Свежий пост', 'group': self.group.id},
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Свежий пост')
+
+    def test_post_edit_purges_old_group(self):
+        """Перенос поста в другую группу сбрасывает ленту старой группы"""
+        url = reverse('posts:group_list', args=[self.group.slug])
+        self.guest_client.get(url)
+        self.author_client.post(
+            reverse('posts:post_edit', args=[self.post.id]),
+            data={'text': 'Тестовый пост', 'group': self.other_group.id},
+        )
+        response = self.guest_client.get(url)
+        self.assertNotContains(response, 'Тестовый пост')
+
+    def test_stale_page_served_while_rebuilding(self):
+        """Устаревшая страница отдаётся, пока другой запрос её собирает"""
+        url = reverse('posts:index')
+        lock_key = page_cache_key('index', url) + ':lock'
+        with override_settings(PAGE_CACHE_TIMEOUT=0):
+            self.guest_client.get(url)
+            Post.objects.bulk_create(
+                [Post(author=self.user, text='Незаметный пост')])
+            cache.add(lock_key, True)
+            response = self.guest_client.get(url)
+            self.assertNotContains(response, 'Незаметный пост')
+            cache.delete(lock_key)
+            response = self.guest_client.get(url)
+            self.assertContains(response, 'Незаметный пост')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_ASYNC=True)
+class AsyncThumbnailTest(TestCase):
+    """Миниатюры строятся в пуле процессов, а не во время запроса"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='async.gif',
+                content=small_gif,
+                content_type='image/gif'
+            )
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(AsyncThumbnailTest.user)
+
+    @mock.patch('posts.thumbnails.transaction.on_commit', lambda func: func())
+    @mock.patch('posts.thumbnails.get_executor')
+    def test_placeholder_until_thumbnail_ready(self, get_executor):
+        """Пока миниатюры нет, выводится заглушка и ставится задача"""
+        response = self.author_client.get(reverse('posts:index'))
+        self.assertContains(response, settings.THUMBNAIL_PLACEHOLDER)
+        submit = get_executor.return_value.submit
+        submit.assert_called_once_with(
+            run_task, build_thumbnails, self.post.image.name)
+        build_thumbnails(self.post.image.name)
+        callback, = submit.return_value.add_done_callback.call_args[0]
+        submit.return_value.exception.return_value = None
+        callback(submit.return_value)
+        response = self.author_client.get(reverse('posts:index'))
+        self.assertNotContains(response, settings.THUMBNAIL_PLACEHOLDER)
+        self.assertContains(response, '/media/cache/')
+
+    def test_warm_thumbnails_command(self):
+        """Команда warm_thumbnails строит миниатюры и запоминает позицию"""
+        state_file = os.path.join(TEMP_MEDIA_ROOT, 'warm.state')
+        call_command('warm_thumbnails', workers=0, state_file=state_file,
+                     stdout=StringIO())
+        geometry, options = settings.THUMBNAIL_GEOMETRIES[0]
+        self.assertIsNotNone(
+            cached_thumbnail(self.post.image, geometry, **options))
+        with open(state_file) as state:
+            self.assertEqual(state.read(), str(self.post.id))
+
+    def test_warm_thumbnails_counts_failures(self):
+        """Неудачные картинки считаются ошибками, а не готовыми"""
+        out = StringIO()
+        with mock.patch(
+                'posts.management.commands.warm_thumbnails.build_thumbnails',
+                side_effect=OSError('битая картинка')) as build:
+            call_command('warm_thumbnails', workers=0, stdout=out,
+                         stderr=StringIO())
+        build.assert_called_once_with(self.post.image.name)
+        self.assertIn('Готово: 0 картинок, ошибок: 1', out.getvalue())
+
+    def test_image_variants_rendered_as_srcset(self):
+        """Варианты картинки сохраняются в посте и выводятся в srcset"""
+        source = BytesIO()
+        Image.new('RGB', (1000, 400)).save(source, 'PNG')
+        post = Post.objects.create(
+            author=AsyncThumbnailTest.user,
+            text='Пост с большой картинкой',
+            image=SimpleUploadedFile(
+                name='large.png',
+                content=source.getvalue(),
+                content_type='image/png'
+            )
+        )
+        generate_thumbnails(post.image.name)
+        post.refresh_from_db()
+        widths = [
+            width for width in settings.POST_IMAGE_WIDTHS if width <= 1000]
+        self.assertEqual(
+            [variant['width'] for variant in post.image_variant_list],
+            widths * len(settings.POST_IMAGE_FORMATS)
+        )
+        response = self.author_client.get(
+            reverse('posts:post_detail', args=[post.id]))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f'{widths[-1]}w')
+        self.assertNotContains(response, f'{settings.POST_IMAGE_WIDTHS[-1]}w')
+
+    def test_small_image_not_upscaled(self):
+        """Картинка уже самого узкого варианта не увеличивается"""
+        generate_thumbnails(self.post.image.name)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(
+            len(post.image_variant_list), len(settings.POST_IMAGE_FORMATS))
+        for variant in post.image_variant_list:
+            self.assertEqual((variant['width'], variant['height']), (2, 1))
+            with default_storage.open(variant['name']) as file, \
+                    Image.open(file) as image:
+                self.assertEqual(image.size, (2, 1))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_ASYNC=True)
+class ThumbnailPoolTest(TransactionTestCase):
+    """Задача в настоящем пуле процессов сбрасывает кэш веб-процесса"""
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        os.makedirs(TEMP_MEDIA_ROOT, exist_ok=True)
+
+    def create_post(self):
+        return Post.objects.create(
+            author=User.objects.create_user(username='author'),
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='pool.gif',
+                content=(
+                    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                    b'\x0A\x00\x3B'
+                ),
+                content_type='image/gif'
+            )
+        )
+
+    def make_executor(self):
+        # Тестовая БД в памяти недоступна дочернему процессу: он
+        # работает с файловой копией.
+        database_name = os.path.join(TEMP_MEDIA_ROOT, 'pool.sqlite3')
+        copy = sqlite3.connect(database_name)
+        connection.ensure_connection()
+        connection.connection.backup(copy)
+        copy.close()
+        return make_executor(1, database_name=database_name)
+
+    def test_pool_refreshes_cards_in_parent(self):
+        """После задачи пула карточка с заглушкой уходит из кэша"""
+        cache.clear()
+        post = self.create_post()
+        executor = self.make_executor()
+        with mock.patch('posts.thumbnails._executor', executor), \
+                mock.patch('posts.thumbnails.transaction.on_commit',
+                           lambda func: func()):
+            response = self.client.get(reverse('posts:index'))
+            self.assertContains(response, settings.THUMBNAIL_PLACEHOLDER)
+            card_key = post_card_key(post.id, post.pub_date)
+            self.assertIsNotNone(cache.get(card_key))
+            executor.shutdown(wait=True)
+        self.assertIsNone(cache.get(card_key))
+        self.assertIsNone(cache.get(f'thumbnail:queued:{post.image.name}'))
+        self.assertTrue(os.listdir(os.path.join(TEMP_MEDIA_ROOT, 'cache')))
+
+    def test_pool_flushes_metrics(self):
+        """Процесс пула пишет свои метрики в METRICS_DIR"""
+        metrics_dir = os.path.join(TEMP_MEDIA_ROOT, 'metrics')
+        post = self.create_post()
+        with override_settings(METRICS_DIR=metrics_dir):
+            executor = self.make_executor()
+            executor.submit(
+                run_task, build_thumbnails, post.image.name).result()
+            executor.shutdown(wait=True)
+        worker_files = [
+            name for name in os.listdir(metrics_dir)
+            if not name.startswith(f'{os.getpid()}-')
+        ]
+        self.assertEqual(len(worker_files), 1)
+        with open(os.path.join(metrics_dir, worker_files[0])) as file:
+            snapshot = json.load(file)
+        generated = [
+            value for name, labels, value in snapshot['counters']
+            if name == 'yatube_thumbnails_generated_total'
+        ]
+        self.assertEqual(len(generated), 1)
+        self.assertGreater(generated[0], 0)
+
+
+class SearchViewMixin:
+    """Поиск по постам и комментариям; backend задают наследники"""
+    backend = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.old_post = Post.objects.create(
+            author=cls.user, text='Варенье из крыжовника')
+        Post.objects.filter(pk=cls.old_post.pk).update(
+            pub_date=cls.old_post.pub_date - timedelta(days=2))
+        cls.post = Post.objects.create(
+            author=cls.user, text='Варенье из клубники')
+        cls.commented = Post.objects.create(
+            author=cls.user, text='Пост без ягод')
+        Comment.objects.create(
+            post=cls.commented, author=cls.user, text='А я люблю варенье')
+        list(rebuild_index(get_search_backend(cls.backend)))
+
+    def setUp(self):
+        self.override = override_settings(SEARCH_BACKEND=self.backend)
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': query, **params})
+        return [post.pk for post in response.context['page_obj']]
+
+    def test_ranked_by_relevance_and_recency(self):
+        """Свежий пост выше старого, совпадение в тексте выше комментария"""
+        self.assertEqual(
+            self.search('Варенье'),
+            [self.post.pk, self.old_post.pk, self.commented.pk]
+        )
+        self.assertEqual(self.search('варенье клубники'), [self.post.pk])
+        self.assertEqual(self.search('малина'), [])
+
+    @mock.patch('posts.search.transaction.on_commit', lambda func: func())
+    def test_index_follows_signals(self):
+        """Индекс обновляется при изменении постов и комментариев"""
+        comment = Comment.objects.create(
+            post=self.old_post, author=self.user, text='Добавлю мяты')
+        self.assertEqual(self.search('мяты'), [self.old_post.pk])
+        comment.delete()
+        self.assertEqual(self.search('мяты'), [])
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Джем из клубники'
+        post.save()
+        self.assertEqual(self.search('варенье клубники'), [])
+        Post.objects.get(pk=self.old_post.pk).delete()
+        self.assertEqual(self.search('крыжовника'), [])
+
+    def test_filter_queryset(self):
+        """Фильтр выборки по индексу для поиска в админке"""
+        posts = get_search_backend(self.backend).filter(
+            Post.objects.all(), 'варенье')
+        self.assertEqual(
+            set(posts.values_list('pk', flat=True)),
+            {self.post.pk, self.old_post.pk, self.commented.pk}
+        )
+
+    def test_pagination_keeps_query(self):
+        """Ссылки пагинатора сохраняют поисковый запрос"""
+        with self.settings(NUM_OF_POSTS=1):
+            response = self.client.get(reverse('posts:search'),
+                                       {'q': 'варенье'})
+            self.assertContains(response, '?q=%D0%B2%D0%B0%D1%80%D0%B5%D0'
+                                          '%BD%D1%8C%D0%B5&amp;page=2')
+            self.assertEqual(self.search('варенье', page=3),
+                             [self.commented.pk])
+
+
+class Fts5SearchViewTest(SearchViewMixin, TestCase):
+    backend = 'fts5'
+
+
+class TokenIndexSearchViewTest(SearchViewMixin, TestCase):
+    backend = 'index'
+
+
+@mock.patch('posts.search.transaction.on_commit', lambda func: func())
+class AdminChangelistTest(TestCase):
+    """Списки админки не делают запросов на каждую строку"""
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.group = Group.objects.create(
+            title='Тестовая группа', slug='test', description='Описание')
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(
+                author=self.admin, group=self.group, text=f'Пост {i}')
+            Comment.objects.create(
+                post=post, author=self.admin, text=f'Комментарий {i}')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        """Число запросов не зависит от числа строк на странице"""
+        urls = [reverse('admin:posts_comment_changelist'),
+                reverse('admin:posts_authorstats_changelist')]
+        self.create_posts(2)
+        before = [self.count_queries(url) for url in urls]
+        self.create_posts(4)
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+
+    def test_changelist_count_without_statistics(self):
+        """Без статистики БД админка считает строки точно, а не по id"""
+        self.create_posts(3)
+        Post.objects.filter(
+            pk__in=Post.objects.values('pk')[:2]).delete()
+        response = self.client.get(reverse('admin:posts_post_changelist'))
+        self.assertEqual(response.context['cl'].paginator.count, 1)
+
+    def test_group_editable_with_autocomplete(self):
+        """Группа в списке постов выбирается автокомплитом, а не <select>
+        со всеми группами"""
+        self.create_posts(2)
+        Group.objects.bulk_create(
+            Group(title=f'Группа {i}', slug=f'group-{i}', description='')
+            for i in range(20))
+        response = self.client.get(reverse('admin:posts_post_changelist'))
+        self.assertContains(response, 'class="admin-autocomplete"', count=2)
+        self.assertNotContains(response, 'Группа 19')
+
+    def test_search_uses_index(self):
+        """Поиск в админке находит посты и комментарии по словам"""
+        self.create_posts(3)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'пост'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response = self.client.get(
+            reverse('admin:posts_comment_changelist'), {'q': 'Комментарий 1'})
+        self.assertEqual(
+            [comment.text for comment in response.context['cl'].result_list],
+            ['Комментарий 1']
+        )
+
+
+class BenchViewsCommandTest(TestCase):
+    """Команда bench_views проходит на минимальных данных"""
+    def test_one_request_per_view(self):
+        """Отчёт содержит строку и замеры для каждой вью"""
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            # Команда создаёт и удаляет свою тестовую БД, поэтому
+            # запускается в отдельном процессе.
+            result = subprocess.run(
+                [sys.executable, 'manage.py', 'bench_views', '--users', '2',
+                 '--groups', '1', '--posts', '3', '--comments', '2',
+                 '--images', '1', '--requests', '1', '--output', output],
+                cwd=settings.BASE_DIR, capture_output=True, text=True,
+                timeout=300,
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            with open(output) as report:
+                results = json.load(report)['results']
+        lines = result.stdout.splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('view'))
+        self.assertEqual(list(results), [line.split()[0]
+                                         for line in lines[1:]])
+        for row in results.values():
+            self.assertEqual(set(row),
+                             {'p50_ms', 'p95_ms', 'queries', 'bytes'})
@@ -0,0 +1,236 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from PIL import Image
+from sorl.thumbnail import default, delete, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from .cache import purge_page_cache
+from .models import GroupFeedEntry, Post
+from .storage import post_image_storage
+from .utils import invalidate_post_cards
+from .workers import run_task, setup_django
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+WORKER_SETTINGS = ('MEDIA_ROOT', 'METRICS_DIR')
+
+
+def get_executor(max_workers=None):
+    """Пул процессов для миниатюр, общий для всего процесса."""
+    global _executor
+    if _executor is None:
+        _executor = make_executor(max_workers)
+    return _executor
+
+
+def make_executor(max_workers=None, database_name=None):
+    # spawn, а не fork: дочерний процесс не должен делить с родителем
+    # соединения с БД. WORKER_SETTINGS передаются явно: настройки,
+    # изменённые в родителе во время работы, дочерний процесс не видит.
+    # Задачи отправляются через run_task, чтобы метрики пула попадали
+    # в METRICS_DIR.
+    return ProcessPoolExecutor(
+        max_workers=max_workers or settings.THUMBNAIL_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=setup_django,
+        initargs=({name: getattr(settings, name) for name in WORKER_SETTINGS},
+                  database_name),
+    )
+
+
+def cached_thumbnail(file_, geometry, **options):
+    """Готовая миниатюра из KV-хранилища sorl или None, без генерации."""
+    backend = default.backend
+    source = ImageFile(file_)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return default.kvstore.get(ImageFile(name, default.storage))
+
+
+def source_image(name):
+    """Оригинал поста для sorl: с тем же хранилищем, что у Post.image,
+    иначе ключи миниатюр в KV-хранилище не совпадут с шаблонными."""
+    return ImageFile(name, post_image_storage)
+
+
+def variant_widths(size):
+    """Ширины POST_IMAGE_WIDTHS, которые можно вырезать из оригинала
+    размера size без увеличения.
+
+    Если оригинал уже самой маленькой ширины, остаётся один вариант
+    в его собственную ширину.
+    """
+    ratio_width, ratio_height = settings.POST_IMAGE_RATIO
+    source_width, source_height = size
+    max_width = max(1, min(
+        source_width, source_height * ratio_width // ratio_height))
+    return [
+        width for width in settings.POST_IMAGE_WIDTHS if width <= max_width
+    ] or [max_width]
+
+
+def build_image_variants(name):
+    """Копии картинки шириной POST_IMAGE_WIDTHS в POST_IMAGE_FORMATS.
+
+    Ширины больше оригинала пропускаются: увеличенная копия весит
+    больше и не становится чётче.
+    """
+    ratio_width, ratio_height = settings.POST_IMAGE_RATIO
+    with post_image_storage.open(name) as source, Image.open(source) as image:
+        widths = variant_widths(image.size)
+    variants = []
+    for image_format in settings.POST_IMAGE_FORMATS:
+        for width in widths:
+            height = max(1, round(width * ratio_height / ratio_width))
+            variant = get_thumbnail(
+                source_image(name), f'{width}x{height}', crop='center',
+                upscale=False, format=image_format)
+            variants.append({
+                'width': width,
+                'height': height,
+                'format': image_format,
+                'name': variant.name,
+            })
+    return variants
+
+
+def generate_thumbnails(name):
+    """Построить миниатюры и сбросить кэш страниц с заглушкой."""
+    build_thumbnails(name)
+    refresh_pages(name)
+    return name
+
+
+def build_thumbnails(name):
+    """Построить миниатюры THUMBNAIL_GEOMETRIES и варианты для srcset.
+
+    Кэш страниц не трогает: в процессе пула он свой, и сбрасывать его
+    должен процесс, поставивший задачу.
+    """
+    for geometry, options in settings.THUMBNAIL_GEOMETRIES:
+        get_thumbnail(source_image(name), geometry, **options)
+    variants = json.dumps(build_image_variants(name))
+    Post.objects.filter(image=name).update(image_variants=variants)
+    GroupFeedEntry.objects.filter(image=name).update(
+        image_variants=variants)
+    return name
+
+
+def share_image_variants(name):
+    """Взять готовые варианты у другого поста с той же картинкой.
+
+    Возвращает True, если генерировать миниатюры не нужно.
+    """
+    variants = Post.objects.filter(image=name).exclude(
+        image_variants='').values_list('image_variants', flat=True).first()
+    if variants is None:
+        return False
+    Post.objects.filter(image=name, image_variants='').update(
+        image_variants=variants)
+    GroupFeedEntry.objects.filter(image=name, image_variants='').update(
+        image_variants=variants)
+    return True
+
+
+def release_image(name):
+    """Удалить картинку и её миниатюры, если на неё не ссылается ни один
+    пост. Возвращает True, если файл удалён.
+
+    Проверка ссылок и удаление идут в одной транзакции. Файл, который
+    сохраняли моложе POST_IMAGE_RELEASE_MIN_AGE секунд назад, остаётся:
+    та же картинка могла прийти с другим постом, ещё не записанным в БД.
+    Такие файлы позже удалит gc_media.
+    """
+    if not name:
+        return False
+    with transaction.atomic():
+        if Post.objects.select_for_update().filter(image=name).exists():
+            return False
+        try:
+            age = time.time() - os.path.getmtime(
+                post_image_storage.path(name))
+        except FileNotFoundError:
+            age = None
+        if age is not None and age < settings.POST_IMAGE_RELEASE_MIN_AGE:
+            return False
+        delete(source_image(name))
+    return True
+
+
+def refresh_pages(name):
+    """Сбросить карточки и страницы с заглушкой вместо миниатюры.
+
+    Вызывается в процессе, поставившем задачу построения миниатюр.
+    """
+    post_list = Post.objects.filter(image=name).select_related(
+        'author', 'group')
+    invalidate_post_cards(post_list)
+    for post in post_list:
+        scopes = ['index', f'profile:{post.author.username}']
+        if post.group:
+            scopes.append(f'group:{post.group.slug}')
+        purge_page_cache(*scopes)
+
+
+def _thumbnails_done(name):
+    """Колбэк задачи пула: сбросить кэш страниц в этом процессе.
+
+    Вызывается в служебном потоке пула, поэтому открытое здесь
+    соединение с БД закрывается сразу.
+    """
+    def callback(future):
+        cache.delete(f'thumbnail:queued:{name}')
+        if future.exception() is not None:
+            logger.error('Thumbnail generation failed',
+                         exc_info=future.exception())
+            return
+        opened = connection.connection is None
+        try:
+            refresh_pages(name)
+        except Exception:
+            logger.exception('Page cache refresh failed')
+        finally:
+            if opened:
+                connection.close()
+    return callback
+
+
+def schedule_thumbnails(name):
+    """Построить миниатюры после коммита транзакции.
+
+    С THUMBNAIL_ASYNC работа уходит в пул процессов, без него выполняется
+    в текущем процессе. Кэш карточек и страниц в обоих случаях сбрасывает
+    текущий процесс: у LocMemCache он виден только ему.
+    """
+    if not name or share_image_variants(name):
+        return
+    if not settings.THUMBNAIL_ASYNC:
+        transaction.on_commit(lambda: generate_thumbnails(name))
+        return
+    if not cache.add(f'thumbnail:queued:{name}', True,
+                     settings.THUMBNAIL_QUEUE_TIMEOUT):
+        return
+
+    def submit():
+        future = get_executor().submit(run_task, build_thumbnails, name)
+        future.add_done_callback(_thumbnails_done(name))
+
+    transaction.on_commit(submit)
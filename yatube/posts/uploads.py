@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    StopUpload, TemporaryFileUploadHandler)
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+upload_stats = {'files': 0, 'bytes': 0, 'seconds': 0.0}
+
+
+def upload_snapshot():
+    """Копия счётчиков принятых процессом загрузок."""
+    with _stats_lock:
+        return dict(upload_stats)
+
+
+class BoundedImageUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загрузку во временный файл порциями.
+
+    Как только файл превышает POST_IMAGE_MAX_UPLOAD_SIZE, приём
+    прерывается без чтения остатка тела, а запрос помечается
+    upload_rejected.
+    """
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.started = time.monotonic()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.POST_IMAGE_MAX_UPLOAD_SIZE:
+            self.file.close()
+            self.request.upload_rejected = True
+            logger.info('Upload %s rejected after %d bytes',
+                        self.file_name, self.received)
+            raise StopUpload(connection_reset=True)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        elapsed = time.monotonic() - self.started
+        with _stats_lock:
+            upload_stats['files'] += 1
+            upload_stats['bytes'] += file_size
+            upload_stats['seconds'] += elapsed
+        logger.info('Upload %s: %d bytes in %.3fs',
+                    self.file_name, file_size, elapsed)
+        return upload
+
+
+def reject_oversized_upload(view_func):
+    """Принимать файлы BoundedImageUploadHandler и отвечать 413, если
+    он прервал загрузку.
+
+    Обработчик ставится только этим представлениям, остальные формы
+    сайта (включая админку) принимают файлы как обычно. Подменить
+    upload_handlers можно лишь до разбора тела, а CsrfViewMiddleware
+    разбирает его раньше представления, поэтому проверка CSRF
+    переносится внутрь, после подмены.
+
+    Тело прерванного запроса разобрано не до конца, и по оставшимся
+    полям формы ничего сохранять нельзя.
+    """
+    @csrf_protect
+    @wraps(view_func)
+    def checked(request, *args, **kwargs):
+        if request.method == 'POST':
+            # Разбор тела запускает обработчики загрузки.
+            request.POST
+            if getattr(request, 'upload_rejected', False):
+                return HttpResponse(status=413)
+        return view_func(request, *args, **kwargs)
+
+    @csrf_exempt
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [BoundedImageUploadHandler(request)]
+        return checked(request, *args, **kwargs)
+    return wrapper
@@ -13,4 +13,5 @@ urlpatterns = [
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('group/<slug:slug>/', views.groups, name='group_list'),
     path('create/', views.post_create, name='post_create'),
+    path('search/', views.search, name='search'),
 ]
@@ -1,7 +1,377 @@
-from django.core.paginator import Paginator
+import hashlib
+from contextlib import contextmanager
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.paginator import (EmptyPage, Page, PageNotAnInteger,
+                                   Paginator)
 from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .models import AuthorStats, Comment, Post
+
+
+def exact_count(queryset):
+    return queryset.count(), True
+
+
+def cached_count(queryset):
+    """COUNT(*), сохранённый в кэше на PAGINATOR_COUNT_CACHE_TIMEOUT."""
+    sql, params = queryset.query.sql_with_params()
+    key = 'posts:count:' + hashlib.md5(
+        f'{sql}{params}'.encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.PAGINATOR_COUNT_CACHE_TIMEOUT)
+    return count, False
+
+
+def estimated_count(queryset, upper_bound=True):
+    """Оценка числа строк по статистике БД.
+
+    Годится только для выборки всей таблицы; отфильтрованные выборки
+    считаются точно. Если статистики нет (SQLite до ANALYZE), с
+    upper_bound берётся наибольший id - верхняя оценка, которую индекс
+    даёт бесплатно, а без него выборка считается точно.
+    """
+    query = queryset.query
+    if query.where or query.distinct or not query.can_filter():
+        return exact_count(queryset)
+    estimate = _table_estimate(queryset.model, queryset.db)
+    if estimate is None and upper_bound:
+        estimate = _max_pk(queryset.model, queryset.db)
+    if estimate is None:
+        return exact_count(queryset)
+    return estimate, False
+
+
+def _table_estimate(model, using):
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass', [table])
+                row = cursor.fetchone()
+                return row[0] if row and row[0] >= 0 else None
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1',
+                    [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+    except DatabaseError:
+        # sqlite_stat1 появляется только после ANALYZE.
+        pass
+    return None
+
+
+def _max_pk(model, using):
+    if connections[using].vendor != 'sqlite':
+        return None
+    return model._default_manager.using(using).aggregate(
+        last_id=Max('pk'))['last_id'] or 0
+
+
+COUNT_STRATEGIES = {
+    'exact': exact_count,
+    'cached': cached_count,
+    'estimated': estimated_count,
+}
+
+
+def get_count_strategy(name=None):
+    name = name or settings.PAGINATOR_COUNT_STRATEGY
+    if name in COUNT_STRATEGIES:
+        return COUNT_STRATEGIES[name]
+    return import_string(name)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор для админки: COUNT(*) по всей таблице заменён оценкой.
+
+    Наибольший id не годится: после удалений админка показала бы пустые
+    страницы, поэтому без статистики БД число строк считается точно.
+    """
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list, upper_bound=False)[0]
+
+
+class ElidedPage(Page):
+    """Страница с сокращённым списком номеров для шаблона пагинатора."""
+    @property
+    def elided_page_range(self):
+        return list(self.paginator.get_elided_page_range(
+            self.number,
+            on_each_side=settings.PAGINATOR_ON_EACH_SIDE,
+            on_ends=settings.PAGINATOR_ON_ENDS,
+        ))
+
+
+class ElidedPaginator(Paginator):
+    """Пагинатор, который выводит номера страниц с пропусками."""
+    ELLIPSIS = '…'
+    count_is_exact = True
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        """Номера страниц: края и окрестность текущей, пропуски - ELLIPSIS.
+
+        При приблизительном счётчике хвостовые номера не выводятся.
+        """
+        number = self.validate_number(number)
+        num_pages = self.num_pages
+        if num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > on_each_side + on_ends + 2:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            if self.count_is_exact:
+                yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(number + 1, num_pages + 1)
+
+    def _get_page(self, *args, **kwargs):
+        return ElidedPage(*args, **kwargs)
+
+
+class KeysetPage(ElidedPage):
+    """Страница keyset-пагинатора.
+
+    Наличие соседних страниц известно без COUNT(*): пагинатор выбирает
+    на одну запись больше, чем помещается на странице.
+    """
+    def __init__(self, object_list, number, paginator,
+                 has_next, has_previous):
+        # Курсоры строятся по строкам выборки, даже если wrap пагинатора
+        # заменяет их другими объектами.
+        self._edges = (object_list[0], object_list[-1]) if object_list \
+            else None
+        if paginator.wrap is not None:
+            object_list = [paginator.wrap(row) for row in object_list]
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<KeysetPage %s>' % self.number
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return ''
+        return self.paginator.make_cursor(
+            self._edges[1], self.number + 1, forward=True)
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return ''
+        return self.paginator.make_cursor(
+            self._edges[0], self.number - 1, forward=False)
+
+
+class KeysetPaginator(ElidedPaginator):
+    """Пагинатор по ключу (pub_date, id) вместо OFFSET.
+
+    Соседние страницы адресуются непрозрачными курсорами: подписанной
+    парой ключей крайней записи страницы. Запрос следующей страницы
+    становится поиском по индексу, и время ответа не зависит от глубины
+    листания. Переход по номеру страницы (``?page=N``) по-прежнему
+    работает через OFFSET. Функция wrap превращает строки выборки в
+    объекты страницы.
+    """
+    keys = ('pub_date', 'id')
+    cursor_salt = 'posts.keyset'
+
+    def __init__(self, object_list, per_page, keys=None,
+                 count_strategy=None, wrap=None):
+        if keys is not None:
+            self.keys = keys
+        self.wrap = wrap
+        self.count_strategy = get_count_strategy(count_strategy)
+        super().__init__(
+            object_list.order_by(*(f'-{key}' for key in self.keys)),
+            per_page
+        )
+
+    @cached_property
+    def count(self):
+        count, self.count_is_exact = self.count_strategy(self.object_list)
+        return count
+
+    def validate_number(self, number):
+        # Номер проверяется без COUNT(*): пустоту страницы покажет выборка.
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def get_page(self, number):
+        try:
+            return self.page(self.validate_number(number))
+        except PageNotAnInteger:
+            return self.page(1)
+        except EmptyPage:
+            return self._last_page()
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return self._get_page(
+            rows[:self.per_page], number, self,
+            has_next=len(rows) > self.per_page,
+            has_previous=number > 1,
+        )
+
+    def get_cursor_page(self, cursor):
+        """Вернуть страницу по курсору; битый курсор ведёт на первую."""
+        try:
+            values, number, forward = signing.loads(
+                cursor, salt=self.cursor_salt)
+        except (signing.BadSignature, TypeError, ValueError):
+            return self.get_page(1)
+        if forward:
+            rows = list(self.object_list.filter(self._seek(values, 'lt'))
+                        [:self.per_page + 1])
+            if not rows:
+                return self._last_page()
+            return self._get_page(
+                rows[:self.per_page], number, self,
+                has_next=len(rows) > self.per_page,
+                has_previous=True,
+            )
+        rows = list(self.object_list.reverse()
+                    .filter(self._seek(values, 'gt'))[:self.per_page + 1])
+        if len(rows) <= self.per_page:
+            return self.get_page(1)
+        return self._get_page(
+            rows[self.per_page - 1::-1], number, self,
+            has_next=True,
+            has_previous=True,
+        )
+
+    def _last_page(self):
+        try:
+            return self.page(self.num_pages)
+        except EmptyPage:
+            # Приблизительный счётчик завысил число страниц.
+            self.count = self.object_list.count()
+            self.count_is_exact = True
+            del self.num_pages
+            return self.page(self.num_pages)
+
+    def make_cursor(self, obj, number, forward):
+        values = []
+        for key in self.keys:
+            value = getattr(obj, key)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        return signing.dumps([values, number, forward], salt=self.cursor_salt)
+
+    def _seek(self, values, lookup):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        condition = Q()
+        equal = {}
+        for key, value in zip(self.keys, values):
+            condition |= Q(**equal, **{f'{key}__{lookup}': value})
+            equal[key] = value
+        return condition
+
+    def _get_page(self, *args, **kwargs):
+        return KeysetPage(*args, **kwargs)
+
+
+def post_card_key(post_id, pub_date):
+    return make_template_fragment_key('post_card', [post_id, pub_date])
+
+
+def invalidate_post_cards(post_list, chunk_size=500):
+    """Сбросить кэш карточек постов из выборки post_list после коммита.
+
+    Ключи собираются сразу: в pre_delete строки ещё на месте. Сброс до
+    коммита не помогает - параллельный запрос успел бы прочитать старые
+    данные и снова закэшировать карточку.
+    """
+    keys = [post_card_key(post_id, pub_date)
+            for post_id, pub_date in post_list.values_list(
+                'id', 'pub_date').iterator(chunk_size=chunk_size)]
+
+    def delete():
+        for start in range(0, len(keys), chunk_size):
+            cache.delete_many(keys[start:start + chunk_size])
+
+    if keys:
+        transaction.on_commit(delete)
+
+
+def author_posts_count(author):
+    """Число постов автора из AuthorStats, без COUNT(*) по постам."""
+    try:
+        return author.stats.posts_count
+    except AuthorStats.DoesNotExist:
+        return author.posts.count()
+
+
+def pagin_page(post_list, request, count=None, count_strategy=None,
+               keys=None, wrap=None):
+    paginator = KeysetPaginator(post_list, settings.NUM_OF_POSTS, keys=keys,
+                                count_strategy=count_strategy, wrap=wrap)
+    if count is not None:
+        paginator.count = count
+    cursor = request.GET.get('cursor')
+    if cursor:
+        return paginator.get_cursor_page(cursor)
+    return paginator.get_page(request.GET.get('page'))
+
 
+@contextmanager
+def explicit_dates():
+    """Отключить auto_now_add, чтобы bulk_create сохранил заданные даты.
 
-def pagin_page(post_list, page_number):
-    paginator = Paginator(post_list, settings.NUM_OF_POSTS)
-    return paginator.get_page(page_number)
+    Меняет поля моделей для всего процесса, поэтому годится только для
+    отдельно запущенных команд.
+    """
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
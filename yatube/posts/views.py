@@ -1,25 +1,36 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.utils.http import urlencode
 
+from .cache import anonymous_page_cache
 from .models import Post, Group, Comment
+from .search import SearchResults
+from .thumbnails import schedule_thumbnails
+from .uploads import reject_oversized_upload
 from .forms import PostForm, CommentForm
-from .utils import pagin_page
+from .utils import ElidedPaginator, author_posts_count, pagin_page
 
 
+@anonymous_page_cache(lambda: 'index')
 def index(request):
-    post_list = Post.objects.all()
-    page_obj = pagin_page(post_list, request.GET.get('page'))
+    post_list = Post.objects.for_list()
+    page_obj = pagin_page(post_list, request)
     contents = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', contents,)
 
 
+@anonymous_page_cache(lambda slug: f'group:{slug}')
 def groups(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    page_obj = pagin_page(post_list, request.GET.get('page'))
+    # Лента группы хранится готовой: выборка страницы без JOIN.
+    page_obj = pagin_page(group.feed.all(), request,
+                          keys=('pub_date', 'post_id'),
+                          wrap=lambda entry: entry.as_post(group))
     contents = {
         'group': group,
         'page_obj': page_obj,
@@ -27,11 +38,13 @@ def groups(request, slug):
     return render(request, 'posts/group_list.html', contents)
 
 
+@anonymous_page_cache(lambda username: f'profile:{username}')
 def profile(request, username):
-    user_obj = get_object_or_404(User, username=username)
-    post_list = user_obj.posts.all()
-    user_num_of_posts = user_obj.posts.count()
-    page_obj = pagin_page(post_list, request.GET.get('page'))
+    user_obj = get_object_or_404(User.objects.select_related('stats'),
+                                 username=username)
+    post_list = user_obj.posts.for_list()
+    user_num_of_posts = author_posts_count(user_obj)
+    page_obj = pagin_page(post_list, request, count=user_num_of_posts)
     context = {
         'page_obj': page_obj,
         'user_obj': user_obj,
@@ -41,9 +54,10 @@ def profile(request, username):
 
 
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id)
     comments = Comment.objects.filter(
-        post_id__exact=post_id).order_by('-created')
+        post_id__exact=post_id).select_related('author').order_by('-created')
     form = PostForm(
         request.POST or None,
     )
@@ -51,7 +65,7 @@ def post_detail(request, post_id):
         add_comment(request, post_id)
     context = {
         'post': post,
-        'author_num_posts': post.author.posts.count(),
+        'author_num_posts': author_posts_count(post.author),
         'comments': comments,
         'form': form
     }
@@ -59,6 +73,8 @@ def post_detail(request, post_id):
 
 
 @login_required
+@reject_oversized_upload
+@transaction.atomic
 def post_create(request):
     form = PostForm(
         request.POST or None,
@@ -68,11 +84,14 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         form.save()
+        schedule_thumbnails(post.image.name)
         return redirect('posts:profile', username=post.author)
     return render(request, 'posts/create_post.html', {'form': form})
 
 
 @login_required
+@reject_oversized_upload
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     if not request.user == post.author:
@@ -83,7 +102,12 @@ def post_edit(request, post_id):
         instance=post
     )
     if form.is_valid():
+        if 'image' in form.changed_data:
+            # Варианты старой картинки к новой не подходят.
+            post.image_variants = ''
         form.save()
+        if 'image' in form.changed_data:
+            schedule_thumbnails(post.image.name)
         return redirect('posts:post_detail', post_id)
     context = {
         'form': form,
@@ -94,6 +118,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -103,3 +128,18 @@ def add_comment(request, post_id):
         comment.post = post
         comment.save()
     return redirect('posts:post_detail', post_id=post_id)
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        paginator = ElidedPaginator(SearchResults(query),
+                                    settings.NUM_OF_POSTS)
+        page_obj = paginator.get_page(request.GET.get('page'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
@@ -0,0 +1,28 @@
+def setup_django(overrides=None, database_name=None):
+    """Инициализатор процессов пула.
+
+    Модуль не импортирует моделей: он загружается в дочернем процессе
+    раньше, чем Django настроен. overrides (настройки родителя вроде
+    MEDIA_ROOT и METRICS_DIR) и database_name подменяются до первого
+    обращения к хранилищу и БД. Процесс пула считает метрики так же,
+    как веб-процесс, и сразу заводит свой файл в METRICS_DIR.
+    """
+    import django
+    from django.conf import settings
+    for name, value in (overrides or {}).items():
+        setattr(settings, name, value)
+    if database_name:
+        settings.DATABASES['default']['NAME'] = database_name
+    django.setup()
+    from core import metrics
+    metrics.install_hooks()
+    metrics.registry.flush()
+
+
+def run_task(func, *args):
+    """Выполнить задачу пула и записать метрики процесса в METRICS_DIR."""
+    from core import metrics
+    try:
+        return func(*args)
+    finally:
+        metrics.registry.flush()
@@ -48,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,6 +76,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.post_card.post_card_timeout',
             ],
         },
     },
@@ -84,10 +88,70 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
+# Подключение задаётся переменными окружения: DB_ENGINE (sqlite или
+# postgresql), DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT.
+# DB_REPLICAS - через запятую хосты реплик PostgreSQL или, для проверки
+# на одной машине, файлы копий SQLite (см. sync_sqlite_replicas).
+if os.environ.get('DB_ENGINE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'yatube'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get(
+                'DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            # Соединение переживает запрос и проверяется перед следующим.
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            # Выполняются core.db.configure_sqlite на каждом новом
+            # соединении.
+            'PRAGMAS': {
+                'busy_timeout': 5000,  # мс ожидания чужой блокировки
+                'journal_mode': 'wal',  # читатели не ждут писателя
+                'synchronous': 'normal',  # в WAL fsync только на checkpoint
+                'mmap_size': 256 * 2**20,
+            },
+        }
+    }
+
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+        filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        ('HOST' if os.environ.get('DB_ENGINE') == 'postgresql'
+         else 'NAME'): replica.strip(),
+        # В тестах реплика - та же БД, что и основная.
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+# Сколько секунд после записи клиент читает из основной БД.
+DATABASE_PIN_COOKIE = 'db_pin'
+DATABASE_PIN_SECONDS = 10
+# Записи в модели этих приложений закрепляют клиента за основной БД.
+DATABASE_PIN_APPS = ('posts', 'auth')
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Для нескольких процессов подойдёт FileBasedCache или Memcached.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -129,6 +193,13 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# Имена с хэшем содержимого и сжатые копии .gz/.br после collectstatic
+STATICFILES_STORAGE = 'core.storage.CompressedManifestStaticFilesStorage'
+# Сколько секунд клиент кэширует статику с хэшем в имени и медиа:
+# имена картинок постов тоже зависят только от содержимого
+STATIC_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
 
 LOGIN_URL = 'users:login'
 
@@ -140,7 +211,70 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 NUM_OF_POSTS = 10  # Кол-во постов на странице
 
+# Подсчёт постов для пагинатора: 'exact', 'cached', 'estimated'
+# или путь к своей функции
+PAGINATOR_COUNT_STRATEGY = 'exact'
+PAGINATOR_COUNT_CACHE_TIMEOUT = 60
+# Сколько номеров страниц показывать вокруг текущей и по краям
+PAGINATOR_ON_EACH_SIDE = 2
+PAGINATOR_ON_ENDS = 1
+
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24  # Кэш карточки поста, секунд
+
+# Кэш страниц лент для анонимов: свежая страница, сколько ещё отдавать
+# устаревшую, пока один запрос её пересобирает, и таймаут этой пересборки
+PAGE_CACHE_TIMEOUT = 20
+PAGE_CACHE_STALE_TIMEOUT = 60 * 5
+PAGE_CACHE_LOCK_TIMEOUT = 10
+# Параметры запроса, которые читают ленты; остальные не входят в ключ кэша
+PAGE_CACHE_QUERY_PARAMS = ('page', 'cursor')
+
+# Поиск по постам: 'auto' (FTS5 в SQLite, иначе свой индекс), 'fts5',
+# 'index' или путь к своему бэкенду. Через SEARCH_RECENCY_DAYS дней
+# релевантность совпадения падает вдвое.
+SEARCH_BACKEND = 'auto'
+SEARCH_RECENCY_DAYS = 30
+
+# Доля запросов, которые замеряет ProfilingMiddleware (0 - выключено),
+# и число последних замеров каждого представления в отчёте.
+PROFILING_SAMPLE_RATE = 0.01
+PROFILING_WINDOW = 500
+
+# Метрики /metrics. Под несколькими процессами WSGI-сервера задайте
+# METRICS_DIR: каталог, общий для воркеров и очищаемый при выкладке.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5  # секунд
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+METRICS_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Миниатюры постов, которые строятся заранее
+THUMBNAIL_GEOMETRIES = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+# В бою миниатюры строятся в пуле процессов, в разработке - сразу
+# после сохранения поста
+THUMBNAIL_ASYNC = not DEBUG
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_QUEUE_TIMEOUT = 60
+THUMBNAIL_PLACEHOLDER = 'img/placeholder.svg'
+
+# Загрузка фотографий постов: поток во временный файл с ограничениями
+# (posts.uploads.BoundedImageUploadHandler в представлениях постов)
+POST_IMAGE_MAX_UPLOAD_SIZE = 10 * 2**20  # байт
+POST_IMAGE_MAX_PIXELS = 40 * 10**6
+# Оригиналы больше этой стороны уменьшаются при загрузке; None - не уменьшать
+POST_IMAGE_MAX_DIMENSION = 2560
+# Недавно сохранённые картинки не удаляются вместе с постом, их подберёт gc_media
+POST_IMAGE_RELEASE_MIN_AGE = 60  # секунд
+
+# Уменьшенные копии фотографий постов для srcset
+POST_IMAGE_WIDTHS = (320, 640, 960, 1920)
+POST_IMAGE_FORMATS = ('WEBP', 'JPEG')
+POST_IMAGE_RATIO = (960, 339)
+POST_IMAGE_SIZES = '(max-width: 960px) 100vw, 960px'
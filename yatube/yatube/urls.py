@@ -14,15 +14,19 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.views import metrics_view, profiling_report, serve_file
+
 handler404 = 'core.views.page_not_found'
 
 urlpatterns = [
     path('', include('posts.urls', namespace='posts')),
     path('group/<slug:slug>/', include('posts.urls', namespace='posts')),
+    path('metrics', metrics_view, name='metrics'),
+    path('admin/profiling/', profiling_report, name='profiling'),
     path('admin/', admin.site.urls),
     path('about/', include('about.urls', namespace='about')),
     path('auth/', include('users.urls', namespace='auth')),
@@ -32,3 +36,13 @@ if settings.DEBUG:
     urlpatterns += static(
         settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
     )
+else:
+    # Отдача статики после collectstatic и медиа на одном сервере.
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.+)$' % settings.STATIC_URL.lstrip('/'),
+                serve_file, {'document_root': settings.STATIC_ROOT,
+                             'max_age': settings.STATIC_CACHE_MAX_AGE}),
+        re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'),
+                serve_file, {'document_root': settings.MEDIA_ROOT,
+                             'max_age': settings.MEDIA_CACHE_MAX_AGE}),
+    ]